@@ -0,0 +1,319 @@
+"""
+Benchmarks for canvis (main.py).
+
+Run every benchmark with 'python benchmark.py', or only some with 'python benchmark.py sort_10k refresh ...'.
+Nothing here needs a Canvas token or a network connection: downloads go to a fake_canvas.FakeCanvas on localhost, and
+canvis's data and cache files are kept in a temporary directory.
+Every run is saved to .benchmarks/ and compared with the last saved run, so regressions between versions show up.
+"""
+
+# Imports
+import sys                    # to read arguments
+import os                     # to find and make files
+import io                     # to swallow main.py's progress messages
+import gc                     # to clean up between measurements
+import time                   # to time things
+import json                   # to save results
+import random                 # to make synthetic assignments
+import argparse               # to read command line options
+import warnings               # to quiet canvasapi about the fake server being plain http
+import statistics             # to sum up timings
+import subprocess             # to ask git which version is being measured
+import tempfile               # to keep canvis's files away from the real ones
+import tracemalloc            # to measure memory
+import datetime as dt         # to make due dates and name results
+from contextlib import redirect_stdout
+from canvasapi.assignment import Assignment  # what downloads used to keep around
+from canvasapi.requester import Requester    # needed to make canvasapi objects (never used to send anything)
+import main                   # the program being measured
+from fake_canvas import FakeCanvas, SAMPLE_ASSIGNMENT
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".benchmarks")  # Saved runs
+
+
+# Time fn(setup()) rounds times, like pytest-benchmark does (setup isn't timed, main.py's printing is swallowed)
+# Returns the timings in seconds, along with anything extra(result) adds
+def measure(fn, rounds, setup=None, extra=None):
+    times = []
+    result = None
+    for _ in range(rounds):
+        with redirect_stdout(io.StringIO()):
+            arg = setup() if setup is not None else None
+            gc.collect()
+            start = time.perf_counter()
+            result = fn(arg) if setup is not None else fn()
+            times.append(time.perf_counter() - start)
+    stats = {"rounds": rounds, "min": min(times), "max": max(times), "mean": statistics.mean(times),
+             "median": statistics.median(times), "stddev": statistics.stdev(times) if rounds > 1 else 0.0}
+    if extra is not None:
+        stats.update(extra(result))
+    return stats
+
+
+# Make n canvasapi Assignments from the sample, each with its own id and url like a real download
+def make_canvas_assignments(n):
+    requester = Requester("https://nbprep.instructure.com", "token")
+    asmts = []
+    for i in range(n):
+        data = dict(SAMPLE_ASSIGNMENT, id=i, html_url="https://nbprep.instructure.com/courses/1/assignments/" + str(i))
+        asmts.append(Assignment(requester, data))
+    return asmts
+
+
+# Make n assignment records due from 60 days ago to 120 days from now, spread over 40 courses
+def make_records(n, seed=0):
+    rng = random.Random(seed)
+    now = dt.datetime.now(dt.timezone.utc).replace(microsecond=0)
+    return [main.AssignmentRecord("nbprep.instructure.com", i, 1000 + i % 40, "Assignment " + str(i), now + dt.timedelta(minutes=rng.randrange(-60 * 24 * 60, 120 * 24 * 60)),
+                                  "https://nbprep.instructure.com/courses/1/assignments/" + str(i), None)
+            for i in range(n)]
+
+
+# Memory kept per assignment: full canvasapi Assignments (before) vs AssignmentRecords made from them (after)
+def bench_memory(options, n=10000):
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    canvas_asmts = make_canvas_assignments(n)
+    before = (tracemalloc.get_traced_memory()[0] - base) / n
+    del canvas_asmts
+    gc.collect()
+
+    base = tracemalloc.get_traced_memory()[0]
+    records = [main.assignment_record(asmt, "nbprep.instructure.com") for asmt in make_canvas_assignments(n)]  # canvasapi objects are dropped right away
+    gc.collect()
+    after = (tracemalloc.get_traced_memory()[0] - base) / n
+    tracemalloc.stop()
+
+    print("memory per assignment (" + str(len(records)), "assignments):", round(before), "bytes as canvasapi Assignment,",
+          round(after), "bytes as AssignmentRecord (" + str(round(before / after, 1)) + "x smaller)")
+    return {"canvasapi_bytes": before, "record_bytes": after}
+
+
+# sort_into_dates() on n freshly made records (nothing cached on them yet, like right after a download)
+def bench_sort(options, n):
+    return measure(main.sort_into_dates, options.rounds, lambda: make_records(n), lambda dated: {"items": n, "dates": len(dated)})
+
+
+def bench_sort_10k(options):
+    return bench_sort(options, 10000)
+
+
+def bench_sort_100k(options):
+    return bench_sort(options, 100000)
+
+
+# refresh_assignments() against options.instances fake Canvas instances (one account each, all with the same ids) with
+# options.courses courses of options.assignments assignments each
+# cold: signs in again and starts from an empty cache every round, warm: keeps the sign ins and cache of the round before
+def refresh_against_fake(options, strategy, cold):
+    canvases = [FakeCanvas(options.courses, options.assignments, options.latency / 1000) for _ in range(options.instances)]
+    urls = [canvas.start() for canvas in canvases]
+    main.PAGE_SIZE = options.page_size
+    main.fetch_strategy = strategy
+    main.accounts = [main.Account("benchmark" + str(i), url, "benchmark") for i, url in enumerate(urls)]
+    counted = {}
+
+    def setup():
+        if cold:
+            main.accounts = [main.Account("benchmark" + str(i), url, "benchmark") for i, url in enumerate(urls)]
+            if os.path.exists(main.CACHE_FILE):
+                os.remove(main.CACHE_FILE)
+        counted["requests"] = main.http_stats["requests"]
+        counted["bytes"] = main.http_stats["bytes"]
+
+    def extra(_):
+        return {"requests": main.http_stats["requests"] - counted["requests"], "bytes": main.http_stats["bytes"] - counted["bytes"],
+                "items": sum(canvas.assignment_count() for canvas in canvases)}
+
+    try:
+        if not cold:
+            with redirect_stdout(io.StringIO()):
+                main.refresh_assignments()  # Fill the cache and sign in first
+        return measure(lambda _: main.refresh_assignments(), options.rounds, setup, extra)
+    finally:
+        for canvas in canvases:
+            canvas.stop()
+        main.accounts = None
+        main.fetch_strategy = "course"
+
+
+def bench_refresh(options):
+    return refresh_against_fake(options, "course", True)
+
+
+def bench_refresh_warm(options):
+    return refresh_against_fake(options, "course", False)
+
+
+def bench_refresh_calendar(options):
+    return refresh_against_fake(options, "calendar", True)
+
+
+# Requests and json bytes the fake Canvas sends for one cold refresh (sign in included), without and with the query
+# parameters that let Canvas filter and page server-side (enrollment_state, per_page and, when the cutoff is ahead of now,
+# bucket=future). The cutoff is 2 days ago like the gui's, so bucket=future is only sent in the last case.
+def bench_queries(options):
+    canvas = FakeCanvas(options.courses, options.assignments, options.latency / 1000)
+    url = canvas.start()
+    main.PAGE_SIZE = options.page_size
+    course_query, assignment_query, lower_cutoff = main.course_query, main.assignment_query, main.assignment_lower_cutoff
+    now = dt.datetime.now(dt.timezone.utc)
+    cases = [("without", lambda: {}, lambda: {}, now - dt.timedelta(days=2)),
+             ("with", course_query, assignment_query, now - dt.timedelta(days=2)),
+             ("with_future_cutoff", course_query, assignment_query, now + dt.timedelta(days=1))]
+    results = {}
+    try:
+        for name, main.course_query, main.assignment_query, main.assignment_lower_cutoff in cases:
+            main.accounts = [main.Account("benchmark", url, "benchmark")]
+            if os.path.exists(main.CACHE_FILE):
+                os.remove(main.CACHE_FILE)
+            requests, sent = canvas.requests, canvas.bytes
+            with redirect_stdout(io.StringIO()):
+                main.refresh_assignments()
+            results[name] = {"requests": canvas.requests - requests, "bytes": canvas.bytes - sent,
+                             "items": len(main.inc_assignments.assignments())}
+            print(("queries " + name).ljust(30), results[name]["requests"], "requests,", results[name]["bytes"], "bytes,",
+                  results[name]["items"], "assignments shown")
+    finally:
+        main.course_query, main.assignment_query, main.assignment_lower_cutoff = course_query, assignment_query, lower_cutoff
+        canvas.stop()
+        main.accounts = None
+    return results
+
+
+# refresh_data() on 10k assignments with every tenth one ignored (no data file read, like after ignoring from the gui)
+def bench_refresh_data(options, n=10000):
+    records = make_records(n)
+    ignored = {asmt.key for asmt in records[::10]}
+
+    def setup():
+        main.inc_assignments = main.sort_into_dates(records)
+        main.exc_assignments = {}
+        main.ignored_assignments = set(ignored)
+
+    return measure(lambda _: main.refresh_data(False, False), options.rounds, setup, lambda _: {"items": n})
+
+
+# save_data() with 1000 new ignores and 1000 new nicknames waiting
+def bench_save_data(options, n=1000):
+    def setup():
+        main.pending_ignores.update(dict.fromkeys([("nbprep.instructure.com", asmt_id) for asmt_id in range(n)], True))
+        main.pending_nnames.update({("nbprep.instructure.com", asmt_id): "Nickname " + str(asmt_id) for asmt_id in range(n, 2 * n)})
+
+    return measure(lambda _: main.save_data(), options.rounds, setup, lambda _: {"items": 2 * n})
+
+
+BENCHMARKS = {
+    "memory": bench_memory,
+    "sort_10k": bench_sort_10k,
+    "sort_100k": bench_sort_100k,
+    "refresh": bench_refresh,
+    "refresh_warm": bench_refresh_warm,
+    "refresh_calendar": bench_refresh_calendar,
+    "queries": bench_queries,
+    "refresh_data": bench_refresh_data,
+    "save_data": bench_save_data,
+}
+
+
+# Print one benchmark's timings (and requests, bytes and items if it has them)
+def print_result(name, result):
+    if "mean" not in result:  # Not a timing (printed by the benchmark itself)
+        return
+    line = name.ljust(18) + " mean " + str(round(result["mean"] * 1000, 3)) + " ms +- " + str(round(result["stddev"] * 1000, 3)) + \
+        " (min " + str(round(result["min"] * 1000, 3)) + ", " + str(result["rounds"]) + " rounds)"
+    for key in ("items", "requests", "bytes"):
+        if key in result:
+            line += ", " + str(result[key]) + " " + key
+    print(line)
+
+
+# Version of the code being measured (short commit, marked if there are uncommitted changes)
+def code_version():
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+# Saved runs, oldest first
+def saved_runs():
+    if not os.path.isdir(RESULTS_DIR):
+        return []
+    return sorted(os.path.join(RESULTS_DIR, name) for name in os.listdir(RESULTS_DIR) if name.endswith(".json"))
+
+
+# Save a run as .benchmarks/<number>_<version>_<time>.json, returning its path
+def save_run(run):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    name = str(len(saved_runs()) + 1).zfill(4) + "_" + run["version"] + "_" + run["time"].replace(":", "").replace("-", "")[:15] + ".json"
+    path = os.path.join(RESULTS_DIR, name)
+    with open(path, "w") as file:
+        json.dump(run, file, indent=2)
+    return path
+
+
+# Print how each timing (and request count) changed since an earlier run
+def compare(run, earlier_path):
+    with open(earlier_path) as file:
+        earlier = json.load(file)
+    print("\nCompared with", os.path.basename(earlier_path) + ":")
+    if earlier.get("options") != run["options"]:
+        print("  (options differ:", earlier.get("options"), "then)")
+    for name, result in run["results"].items():
+        before = earlier.get("results", {}).get(name)
+        if before is None or "mean" not in result or "mean" not in before:
+            continue
+        change = (result["mean"] - before["mean"]) / before["mean"] * 100
+        line = "  " + name.ljust(18) + " " + str(round(before["mean"] * 1000, 3)) + " -> " + str(round(result["mean"] * 1000, 3)) + " ms (" + \
+            ("+" if change >= 0 else "") + str(round(change, 1)) + "%)"
+        if "requests" in result and "requests" in before and result["requests"] != before["requests"]:
+            line += ", requests " + str(before["requests"]) + " -> " + str(result["requests"])
+        print(line)
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark canvis against a fake Canvas server.")
+    parser.add_argument("names", nargs="*", metavar="name", help="benchmarks to run (default: all): " + ", ".join(BENCHMARKS))
+    parser.add_argument("--rounds", type=int, default=5, help="times each benchmark is timed (default: 5)")
+    parser.add_argument("--courses", type=int, default=20, help="courses on the fake Canvas (default: 20)")
+    parser.add_argument("--assignments", type=int, default=50, help="assignments per course on the fake Canvas (default: 50)")
+    parser.add_argument("--instances", type=int, default=1, help="fake Canvas instances, each with its own account (default: 1)")
+    parser.add_argument("--latency", type=float, default=0.0, help="milliseconds each fake Canvas request takes (default: 0)")
+    parser.add_argument("--page-size", type=int, default=main.PAGE_SIZE, help="items per page canvis asks for (default: " + str(main.PAGE_SIZE) + ")")
+    parser.add_argument("--no-save", action="store_true", help="don't save this run to .benchmarks/")
+    parser.add_argument("--compare", metavar="FILE", help="saved run to compare with (default: the last one)")
+    args = parser.parse_args(argv)
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: " + name)
+
+    warnings.filterwarnings("ignore", message="Canvas may respond unexpectedly")  # The fake server is plain http
+    earlier = args.compare or (saved_runs() or [None])[-1]
+    results = {}
+    home = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)  # canvis.db and canvis_cache.db go here
+        try:
+            for name in args.names or BENCHMARKS.keys():
+                results[name] = BENCHMARKS[name](args)
+                print_result(name, results[name])
+        finally:
+            os.chdir(home)
+
+    run_info = {"version": code_version(), "time": dt.datetime.now().isoformat(timespec="seconds"), "python": sys.version.split()[0],
+                "options": {key: value for key, value in vars(args).items() if key in ("rounds", "courses", "assignments", "instances", "latency", "page_size")},
+                "results": results}
+    if earlier is not None:
+        compare(run_info, earlier)
+    if not args.no_save:
+        print("\nSaved to", save_run(run_info))
+    return results
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
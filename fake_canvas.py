@@ -0,0 +1,232 @@
+"""
+A stand-in Canvas server for benchmarking canvis (main.py) without a token or a real Canvas instance.
+
+Serves synthetic courses and assignments from the endpoints main.py uses, paginated with Link headers like Canvas:
+    GET /api/v1/users/self
+    GET /api/v1/users/:user_id/courses             (enrollment_state is honored)
+    GET /api/v1/courses/:course_id/assignments   (bucket=future and order_by=due_at are honored)
+    GET /api/v1/calendar_events                  (type=assignment, context_codes[], start_date and end_date are honored)
+
+Run it on its own with 'python fake_canvas.py --courses 40 --assignments 200 --latency 50', then point canvis at it:
+    CANVAS_API_TOKEN=anything python main.py --base-url http://127.0.0.1:8000
+"""
+
+# Imports
+import sys                    # to read arguments
+import argparse               # to read command line options
+import json                   # to send json
+import time                   # to add latency
+import random                 # to make synthetic data
+import threading              # to serve in the background
+import datetime as dt         # to make due dates
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # to serve (one thread per connection, like Canvas takes parallel requests)
+from urllib.parse import urlsplit, parse_qs, urlencode  # to read queries and write next page links
+
+# A typical assignment as Canvas sends it from GET /api/v1/courses/:course_id/assignments
+SAMPLE_ASSIGNMENT = {
+    "id": 0, "course_id": 1, "name": "Unit 4 Problem Set: Kinematics and Projectile Motion",
+    "description": "<p>Complete problems 1-24 from chapter 4. Show all work, including free body diagrams where they apply, "
+                   "and box your final answers. Problems marked with a star are optional for extra credit.</p>"
+                   "<p>Submit a single PDF. Late work loses 10% per day.</p>",
+    "due_at": "2022-03-01T06:59:59Z", "unlock_at": "2022-02-20T07:00:00Z", "lock_at": "2022-03-08T06:59:59Z",
+    "created_at": "2022-01-15T18:22:41Z", "updated_at": "2022-02-18T20:03:12Z",
+    "points_possible": 40.0, "grading_type": "points", "assignment_group_id": 5012, "grading_standard_id": None,
+    "peer_reviews": False, "automatic_peer_reviews": False, "position": 7, "grade_group_students_individually": False,
+    "anonymous_peer_reviews": False, "group_category_id": None, "post_to_sis": False, "moderated_grading": False,
+    "omit_from_final_grade": False, "intra_group_peer_reviews": False, "anonymous_instructor_annotations": False,
+    "anonymous_grading": False, "graders_anonymous_to_graders": False, "grader_count": 0,
+    "grader_comments_visible_to_graders": True, "final_grader_id": None, "grader_names_visible_to_final_grader": True,
+    "allowed_attempts": -1, "secure_params": "eyJ0eXAiOiJKV1QiLCJhbGciOiJIUzI1NiJ9.eyJsdGlfYXNzaWdubWVudF9pZCI6IjEyMyJ9.c2ln",
+    "submission_types": ["online_upload"], "has_submitted_submissions": True, "due_date_required": False,
+    "max_name_length": 255, "in_closed_grading_period": False, "is_quiz_assignment": False, "can_duplicate": True,
+    "original_course_id": None, "original_assignment_id": None, "original_assignment_name": None, "original_quiz_id": None,
+    "workflow_state": "published", "muted": True, "html_url": "https://nbprep.instructure.com/courses/1/assignments/0",
+    "has_overrides": False, "needs_grading_count": 0, "sis_assignment_id": None, "integration_id": None,
+    "integration_data": {}, "published": True, "unpublishable": False, "only_visible_to_overrides": False,
+    "locked_for_user": False, "submissions_download_url": "https://nbprep.instructure.com/courses/1/assignments/0/submissions?zip=1",
+    "post_manually": False, "anonymize_students": False, "require_lockdown_browser": False,
+}
+
+DEFAULT_PER_PAGE = 10   # Items per page when a request doesn't ask (same as Canvas)
+MAX_PER_PAGE = 100      # Most items per page a request can get (same as Canvas)
+
+
+# Turn a datetime into the text Canvas sends
+def canvas_time(date):
+    return date.astimezone(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+# Read the text Canvas sends (or takes) back into a datetime
+def parse_time(text):
+    return dt.datetime.fromisoformat(text.replace("Z", "+00:00"))
+
+
+# Synthetic Canvas data and the server that sends it
+#   courses:     number of courses the user is in (every fifth started before canvis's course cutoff, every fourth has ended,
+#                every sixth has a completed enrollment instead of an active one)
+#   assignments: number of assignments in each course (every tenth has no due date, the rest are due from 60 days ago to 120 from now)
+#   latency:     seconds each request waits before it's answered
+#   max_per_page: most items per page a request can get
+class FakeCanvas:
+    def __init__(self, courses=20, assignments=50, latency=0.0, max_per_page=MAX_PER_PAGE, seed=0):
+        self.latency = latency
+        self.max_per_page = max_per_page
+        self.requests = 0       # Requests answered
+        self.bytes = 0          # Bytes of json sent
+        self.lock = threading.Lock()
+        self.server = None
+        self.url = None
+
+        # Make the data (the same every time for the same arguments)
+        rng = random.Random(seed)
+        now = dt.datetime.now(dt.timezone.utc).replace(microsecond=0)
+        self.user = {"id": 1, "name": "Benchmark Student", "sortable_name": "Student, Benchmark", "short_name": "Benchmark"}
+        self.courses = []
+        self.assignments = {}   # Course id to its assignments, in id order
+        for c in range(courses):
+            course_id = 1000 + c
+            start = dt.datetime(2020, 8, 15, tzinfo=dt.timezone.utc) if c % 5 == 4 else now - dt.timedelta(days=120)
+            end = now - dt.timedelta(days=10) if c % 4 == 3 else now + dt.timedelta(days=120)
+            self.courses.append({"id": course_id, "name": "Course " + str(c), "course_code": "C" + str(c).zfill(3),
+                                 "start_at": canvas_time(start), "end_at": canvas_time(end), "workflow_state": "available",
+                                 "enrollment_term_id": 1, "default_view": "modules", "time_zone": "America/New_York",
+                                 "enrollments": [{"type": "student", "role": "StudentEnrollment", "user_id": 1,
+                                                  "enrollment_state": "completed" if c % 6 == 5 else "active"}]})
+            asmts = []
+            for a in range(assignments):
+                asmt_id = course_id * 100000 + a
+                due = None if a % 10 == 9 else now + dt.timedelta(minutes=rng.randrange(-60 * 24 * 60, 120 * 24 * 60))
+                url = "https://canvas.example/courses/" + str(course_id) + "/assignments/" + str(asmt_id)
+                asmts.append(dict(SAMPLE_ASSIGNMENT, id=asmt_id, course_id=course_id, name="Assignment " + str(a) + " of course " + str(c),
+                                  due_at=canvas_time(due) if due is not None else None, html_url=url,
+                                  submissions_download_url=url + "/submissions?zip=1"))
+            self.assignments[course_id] = asmts
+
+    # Start serving on a free port in the background, returning the base url to give canvis
+    def start(self, port=0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), FakeCanvasHandler)
+        self.server.daemon_threads = True
+        self.server.canvas = self
+        self.url = "http://127.0.0.1:" + str(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, name="fake-canvas", daemon=True).start()
+        return self.url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    # Total number of assignments, and of assignments with due dates
+    def assignment_count(self):
+        return sum(len(asmts) for asmts in self.assignments.values())
+
+    # Items a path and query point to, or None if nothing is there
+    def listing(self, path, query):
+        parts = path.strip("/").split("/")
+        if parts[:2] != ["api", "v1"]:
+            return None
+        parts = parts[2:]
+        if parts == ["users", "self"]:
+            return self.user
+        if len(parts) == 3 and parts[0] == "users" and parts[2] == "courses":
+            if "enrollment_state" in query:  # Only courses the user has an enrollment in that state in, like Canvas
+                return [course for course in self.courses
+                        if any(enrollment["enrollment_state"] in query["enrollment_state"] for enrollment in course["enrollments"])]
+            return self.courses
+        if len(parts) == 3 and parts[0] == "courses" and parts[2] == "assignments":
+            asmts = self.assignments.get(int(parts[1])) if parts[1].isdigit() else None
+            if asmts is None:
+                return None
+            if query.get("bucket") == ["future"]:  # Due from now on (undated ones aren't 'future')
+                now = dt.datetime.now(dt.timezone.utc)
+                asmts = [asmt for asmt in asmts if asmt["due_at"] is not None and parse_time(asmt["due_at"]) >= now]
+            if query.get("order_by") == ["due_at"]:  # Undated last, like Canvas
+                asmts = sorted(asmts, key=lambda asmt: (asmt["due_at"] is None, asmt["due_at"] or "", asmt["id"]))
+            return asmts
+        if parts == ["calendar_events"]:
+            return self.calendar_events(query)
+        return None
+
+    # Assignment calendar events of the courses asked for, due between start_date and end_date
+    def calendar_events(self, query):
+        if query.get("type") != ["assignment"]:
+            return []
+        start = parse_time(query["start_date"][0]) if "start_date" in query else None
+        end = parse_time(query["end_date"][0]) if "end_date" in query else None
+        events = []
+        for code in query.get("context_codes[]", []):
+            course_id = int(code.rpartition("_")[2]) if code.startswith("course_") else None
+            for asmt in self.assignments.get(course_id, []):
+                if asmt["due_at"] is None:
+                    continue
+                due = parse_time(asmt["due_at"])
+                if (start is None or due >= start) and (end is None or due <= end):
+                    events.append({"id": "assignment_" + str(asmt["id"]), "title": asmt["name"], "type": "assignment",
+                                   "start_at": asmt["due_at"], "end_at": asmt["due_at"], "context_code": code,
+                                   "html_url": asmt["html_url"], "assignment": asmt})
+        events.sort(key=lambda event: (event["start_at"], event["id"]))
+        return events
+
+
+# Answers requests with a FakeCanvas's data (server.canvas)
+class FakeCanvasHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections alive, like Canvas
+
+    def do_GET(self):
+        canvas = self.server.canvas
+        if canvas.latency:
+            time.sleep(canvas.latency)
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        found = canvas.listing(url.path, query)
+        headers = {"X-Rate-Limit-Remaining": "700.0"}
+
+        if found is None:
+            status, body = 404, {"errors": [{"message": "The specified resource does not exist."}]}
+        elif isinstance(found, dict):
+            status, body = 200, found
+        else:
+            # Paginate lists, with a Link header to the next page like Canvas
+            page = max(1, int(query.get("page", ["1"])[0]))
+            per_page = min(canvas.max_per_page, max(1, int(query.get("per_page", [str(DEFAULT_PER_PAGE)])[0])))
+            status, body = 200, found[(page - 1) * per_page:page * per_page]
+            if page * per_page < len(found):
+                next_query = dict(query, page=[str(page + 1)], per_page=[str(per_page)])
+                headers["Link"] = '<' + canvas.url + url.path + "?" + urlencode(next_query, doseq=True) + '>; rel="next"'
+
+        data = json.dumps(body).encode()
+        with canvas.lock:
+            canvas.requests += 1
+            canvas.bytes += len(data)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):  # Don't print every request
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve synthetic Canvas data for canvis to download.")
+    parser.add_argument("--port", type=int, default=8000, help="port to serve on (default: 8000)")
+    parser.add_argument("--courses", type=int, default=20, help="number of courses (default: 20)")
+    parser.add_argument("--assignments", type=int, default=50, help="assignments per course (default: 50)")
+    parser.add_argument("--latency", type=float, default=0.0, help="milliseconds each request waits (default: 0)")
+    parser.add_argument("--max-per-page", type=int, default=MAX_PER_PAGE, help="most items per page (default: 100)")
+    args = parser.parse_args(argv)
+
+    canvas = FakeCanvas(args.courses, args.assignments, args.latency / 1000, args.max_per_page)
+    print("Serving", len(canvas.courses), "courses and", canvas.assignment_count(), "assignments at", canvas.start(args.port))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        canvas.stop()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -4,37 +4,50 @@ https://docs.google.com/document/d/147exjQT8h3cr-aUrZURNfwWVgqrVaJNRb8Y_hKnKeNA/
 This program downloads a list of the user's courses using a key given in an .env file, removes courses
 from before a relevant start time, downloads the assignments from each course, then removes any manually
 blacklisted assignments and assignments due before a specified date before sorting the remaining ones.
-Currently, the only way to single out an assignment to be ignored is by adding its id to the list saved in
-the first line of the 'canvis.dat' file automatically created in the directory that this script is run.
-Assignments may also be nicknamed by the user. Currently, nicknames must also be manually added to the
-dictionary in the second line of the data file in the format {assignment id: "nickname"}.
+Assignments can be singled out to be ignored and nicknamed from the gui. Both are saved in the 'canvis.db'
+file automatically created in the directory that this script is run (an older 'canvis.dat' file found there
+is moved into it the first time).
 Though the gui appears correctly, it is unfinished. Only the due date cutoff selection at the top and
 redownload/refilter buttons at the bottom are functional.
 """
 
 # Imports
+import time                   # to record the time the program takes to do stuff (imported first so startup is timed from here)
+startup_clock = time.perf_counter()
 import dotenv                 # to import environment variables from another file
 import os                     # to use system stuff
 import ast                    # to parse list and dictionary data from strings (json doesn't accept numeric keys)
-import time                   # to record the time the program takes to do stuff
 import datetime as dt         # to record and compare time
+import bisect                 # to keep dates and assignments sorted without re-sorting
 import webbrowser as wb       # to open links in the user's browser
-from tkinter import *         # to add an interactive gui
-from tkinter import ttk       # modern tkinter widgets
-from canvasapi import Canvas  # sandwich recipes
+import sys                    # to write headless output and read arguments
+import argparse               # to read command line options
+import json                   # to write headless output as json
+import csv                    # to write headless output as csv
+import threading              # to download in the background while the gui keeps running
+import queue                  # to send background download results back to the gui
+import sqlite3                # to cache downloaded courses and assignments
+from contextlib import closing, redirect_stdout  # to close cache connections when done with them, and keep headless output clean
+from concurrent.futures import ThreadPoolExecutor, as_completed  # to download from several courses at once
+import random                 # to spread out retries
+from urllib.parse import urlsplit  # to tell Canvas instances apart by host
+import cProfile               # to profile whole runs (--cprofile)
+# (canvasapi and requests are only imported by load_canvas_api() the first time Canvas is needed, so startup and cached runs
+# don't wait for them, and tkinter is only imported by build_gui(), so headless runs never load it)
 # Load env
-print("<=== Starting ===>")
-start_time = time.time()  # Record start time
 dotenv.load_dotenv(dotenv.find_dotenv())  # Load environment variables
 
 # Objects
-TOKEN = os.environ.get('CANVAS_API_TOKEN')  # Token
-BASEURL = 'https://nbprep.instructure.com'  # URL
-signin = Canvas(BASEURL, TOKEN)             # Sign in
-tk_root = Tk()                              # Create tkinter root
-# Make sure data file exists
-dataFile = open("canvis.dat", "a")
-dataFile.close()
+TOKEN = os.environ.get('CANVAS_API_TOKEN')  # Token (of the default account)
+BASEURL = os.environ.get('CANVAS_BASE_URL', 'https://nbprep.instructure.com')  # URL (of the default account, also --base-url)
+accounts = None                             # Canvas accounts to download from (made by canvas_accounts() the first time they're needed)
+canvasapi = None                            # sandwich recipes (imported by load_canvas_api())
+tk_root = None                              # Tkinter root (None unless the gui is running)
+CACHE_FILE = "canvis_cache.db"              # Cache of downloaded courses and assignments
+DATA_FILE = "canvis.db"                     # Ignored assignments, nicknames & other user data
+LEGACY_DATA_FILE = "canvis.dat"             # Data file of older versions, migrated into DATA_FILE
+DATA_VERSION = 1                            # Version of the DATA_FILE layout
+CACHE_VERSION = 3                           # Version of the CACHE_FILE layout (an older cache is thrown away)
 
 # -Parameters
 # Automatically obtained
@@ -42,219 +55,1338 @@ local_tz = dt.datetime.now().astimezone().tzinfo
 # Read from file
 course_lower_cutoff = dt.datetime(2021, 7, 15, tzinfo=local_tz)     # The earliest date a course can start to be included *temporarily hardcoded
 assignment_lower_cutoff = dt.datetime(2022, 2, 9, tzinfo=local_tz)  # The earliest date an assignment can start to be included *temporarily hardcoded
-ignored_assignments = []                                            # List of ids of assignments specifically selected by user to be ignored
-assignment_nnames = {}                                              # Assignment nicknames
+ignored_assignments = set()                                         # Set of (source, id) keys of assignments specifically selected by user to be ignored
+assignment_nnames = {}                                              # Assignment nicknames, keyed with (source, id)
+# Changes not saved yet
+pending_ignores = {}    # Assignment key: True if it was ignored, False if it was un-ignored
+pending_nnames = {}     # Assignment key: new nickname, or None if the nickname was removed
+# From environment
+download_workers = max(1, int(os.environ.get('CANVIS_WORKERS', 8)))  # Max number of courses downloaded at the same time (from every account together)
+host_connections = max(1, int(os.environ.get('CANVIS_HOST_CONNECTIONS', download_workers)))  # Max requests to one Canvas host at the same time
+course_enrollment_state = os.environ.get('CANVIS_ENROLLMENT_STATE', 'active')  # Only ask Canvas for courses with this enrollment state ('' for all)
+PAGE_SIZE = 100                                                      # Items per page asked of Canvas (Canvas sends 10 if not asked, canvasapi asks for 100 itself)
+fetch_strategy = os.environ.get('CANVIS_FETCH', 'course')             # 'course': one listing per course, 'calendar': bulk calendar listing
+CALENDAR_CONTEXTS = 10                                               # Most courses Canvas takes in one calendar request
+CALENDAR_DAYS = 366                                                  # How far past now the calendar listing looks for due dates
+# HTTP
+MAX_RETRIES = 4           # Times a request is retried after a transient error or being throttled
+RETRY_BASE = 0.5          # Seconds waited before the first retry (doubles every retry)
+THROTTLE_LOW = 150.0      # Below this X-Rate-Limit-Remaining, requests start waiting before they're sent (Canvas starts at 700)
+THROTTLE_MAX_WAIT = 2.0   # Longest wait before a request when the rate limit is nearly used up
+# Gui
+CUTOFF_DELAY = 300        # Milliseconds the cutoff input has to stay unchanged before it's applied
+# Profiling
+profile_trace_file = os.environ.get('CANVIS_TRACE') or None        # Write every span to this file as a JSON trace when done (also --trace)
+profile_cprofile_file = os.environ.get('CANVIS_CPROFILE') or None  # Dump cProfile stats to this file when done (also --cprofile)
+profiling = os.environ.get('CANVIS_PROFILE', '') not in ('', '0') or profile_trace_file is not None  # Time named spans of work (also --profile)
+
+# -Data structures
+# Assignments sorted into dates. Replaces the old 2D list ([] = date, [][] = assignment) with:
+#   buckets: dict of date to the list of that date's assignments (in due order)
+#   dates:   sorted list of every date that has assignments, so dates can be found by index and by binary search
+#   by_key:  dict of assignment key ((source, id), ids are only unique inside one instance) to assignment, so duplicates are caught without scanning
+# Single assignments can be added and removed with a binary search instead of rebuilding everything.
+# Buckets use the local due dates assignments had when they went in, so a time zone change needs a rebuild.
+class DateBuckets:
+    def __init__(self, asmts=()):
+        self.buckets = {}
+        self.dates = []
+        self.by_key = {}
+        self._keys = {}     # Date to the sort keys of its bucket, kept in step with the bucket for bisecting
+        self._date_of = {}  # Assignment key to the date it was put under
+
+        # Build in one pass: sort everything once, then every bucket fills up in order
+        for asmt in sorted(asmts, key=DateBuckets.sort_key):
+            key = asmt.key
+            if key in self.by_key:  # Skip duplicates
+                continue
+            self.by_key[key] = asmt
+            date = self._date_of[key] = DateBuckets.date_key(asmt)
+            if date not in self.buckets:
+                self.dates.append(date)  # Dates come up in order because assignments are sorted
+                self.buckets[date] = []
+                self._keys[date] = []
+            self.buckets[date].append(asmt)
+            self._keys[date].append(DateBuckets.sort_key(asmt))
+
+    # Local date an assignment is due on
+    @staticmethod
+    def date_key(asmt):
+        return asmt.due_date
+
+    # Order of assignments inside a date
+    @staticmethod
+    def sort_key(asmt):
+        return asmt.sort_key
+
+    def __len__(self):  # Number of dates
+        return len(self.dates)
+
+    def __iter__(self):  # (date, bucket) pairs in date order
+        for date in self.dates:
+            yield date, self.buckets[date]
+
+    def __contains__(self, asmt):
+        return asmt.key in self.by_key
+
+    # Date at a position of the date list
+    def date_at(self, date_index):
+        return self.dates[date_index]
+
+    # Assignments of the date at a position of the date list
+    def bucket_at(self, date_index):
+        return self.buckets[self.dates[date_index]]
+
+    # Every assignment in date order
+    def assignments(self):
+        return [asmt for date in self.dates for asmt in self.buckets[date]]
+
+    # Add one assignment. Returns (date index, index in bucket, whether the date is new) or None if it was already there
+    def add(self, asmt):
+        asmt_key = asmt.key
+        if asmt_key in self.by_key:
+            return None
+        self.by_key[asmt_key] = asmt
+        date = self._date_of[asmt_key] = DateBuckets.date_key(asmt)
+        date_index = bisect.bisect_left(self.dates, date)
+        new_date = date not in self.buckets
+        if new_date:
+            self.dates.insert(date_index, date)
+            self.buckets[date] = []
+            self._keys[date] = []
+
+        key = DateBuckets.sort_key(asmt)
+        row = bisect.bisect_left(self._keys[date], key)
+        self._keys[date].insert(row, key)
+        self.buckets[date].insert(row, asmt)
+        return date_index, row, new_date
+
+    # Remove one assignment. Returns (date index, index in bucket, whether the date is now gone) or None if it wasn't there
+    def remove(self, asmt):
+        asmt_key = asmt.key
+        asmt = self.by_key.pop(asmt_key, None)
+        if asmt is None:
+            return None
+        date = self._date_of.pop(asmt_key)
+        date_index = bisect.bisect_left(self.dates, date)
+        row = bisect.bisect_left(self._keys[date], DateBuckets.sort_key(asmt))
+        del self._keys[date][row]
+        del self.buckets[date][row]
+
+        date_gone = len(self.buckets[date]) == 0
+        if date_gone:
+            del self.dates[date_index]
+            del self.buckets[date]
+            del self._keys[date]
+        return date_index, row, date_gone
+
+
+# Course and assignment records: only the fields this program uses, built once when data is downloaded (or loaded from
+# the cache) so the full canvasapi objects, their requester and every other field Canvas sent aren't kept around.
+# __slots__ keeps each one down to a few pointers instead of a dict.
+# source is the Canvas instance a record came from (see instance_of()). Ids are only unique inside one instance, so
+# records are told apart by their key, (source, id).
+class CourseRecord:
+    __slots__ = ("source", "id", "name", "course_code", "start_at_date", "end_at_date")
+
+    def __init__(self, source, id, name, course_code, start_at_date, end_at_date=None):
+        self.source = source
+        self.id = id
+        self.name = name
+        self.course_code = course_code
+        self.start_at_date = start_at_date
+        self.end_at_date = end_at_date
+
+    def __str__(self):  # Same text as a canvasapi Course
+        return "{} {} ({})".format(self.course_code, self.name, self.id)
+
+    @property
+    def key(self):
+        return self.source, self.id
+
+
+class AssignmentRecord:
+    __slots__ = ("source", "id", "course_id", "name", "due_at_date", "html_url", "updated_at", "sort_key", "_due_date", "_due_text", "_time_key")
+
+    def __init__(self, source, id, course_id, name, due_at_date, html_url, updated_at=None):
+        self.source = source
+        self.id = id
+        self.course_id = course_id
+        self.name = name
+        self.due_at_date = due_at_date
+        self.html_url = html_url
+        self.updated_at = updated_at
+        self.sort_key = (due_at_date.timestamp(), source, id)  # Order of assignments (doesn't depend on time zone, source and id break ties)
+        self._time_key = None                                   # time_key the local due date and text were worked out with
+
+    def __str__(self):  # Same text as a canvasapi Assignment
+        return "{} ({})".format(self.name, self.id)
+
+    @property
+    def key(self):  # Made on each use instead of kept, a kept tuple costs every record 64 bytes (hot loops look it up once per record)
+        return self.source, self.id
+
+    @property
+    def course_key(self):  # Key of the course it's in
+        return self.source, self.course_id
+
+    # Local date and display text of the due time, worked out once and kept until the time zone or formats change
+    def _localize(self):
+        local_due = self.due_at_date.astimezone()
+        self._due_date = local_due.date()
+        self._due_text = local_due.strftime(DUE_FORMAT)
+        self._time_key = time_key
+
+    @property
+    def due_date(self):
+        if self._time_key is not time_key:
+            self._localize()
+        return self._due_date
+
+    @property
+    def due_text(self):
+        if self._time_key is not time_key:
+            self._localize()
+        return self._due_text
+
+
+# Make records out of canvasapi objects downloaded from a source
+def course_record(course, source):
+    return CourseRecord(source, course.id, getattr(course, "name", ""), getattr(course, "course_code", ""),
+                        getattr(course, "start_at_date", None), getattr(course, "end_at_date", None))
+
+
+def assignment_record(asmt, source):
+    return AssignmentRecord(source, asmt.id, asmt.course_id, asmt.name, asmt.due_at_date, asmt.html_url, getattr(asmt, "updated_at", None))
+
+
+# -Time display
+DUE_FORMAT = "%m/%d/%Y, %H:%M:%S"  # How due times are shown
+DATE_FORMAT = "%m/%d/%y"           # How dates are shown in the date list
+time_key = None                    # Time zone and formats that cached local dates and texts are made with
+date_texts = {}                    # Date to its text in the date list
+
+
+# Check the system time zone (and formats), and if they changed since last time, drop every cached local date and text
+# Returns whether they changed (everything sorted into dates needs a rebuild then)
+def refresh_time_key():
+    global time_key
+
+    if hasattr(time, "tzset"):
+        time.tzset()  # Pick up a time zone change made while running (not available on Windows)
+    new_key = (time.tzname, time.timezone, time.altzone, DUE_FORMAT, DATE_FORMAT)
+    if new_key == time_key:
+        return False
+    time_key = new_key  # Records compare by identity, so a new tuple invalidates all of them at once
+    date_texts.clear()
+    return True
+
+
+# Text of a date in the date list
+def date_text(date):
+    text = date_texts.get(date)
+    if text is None:
+        text = date_texts[date] = date.strftime(DATE_FORMAT)
+    return text
+
+
+refresh_time_key()
 
 # -Global Variables
 # Assignment data
-inc_courses = {}        # Dict of courses included, keyed with course id
+inc_courses = {}        # Dict of courses included, keyed with course key
 pd_courses = []         # List of courses outdated by given time frame
-inc_assignments = []    # 2D list of assignments included ([] = date, [][] = assignment)
-pd_assignments = []     # List of assignments outdated by given time frame
-exc_assignments = []    # List of assignments excluded by filters
+inc_assignments = DateBuckets()  # Assignments included, sorted into dates
+pd_assignments = []     # List of assignments outdated by given time frame (always the start of due_order)
+exc_assignments = {}    # Dict of assignments hidden by filters, keyed with assignment key
+due_order = []          # Every downloaded assignment (past due too) in due order, so the cutoff can be moved with a binary search
+due_keys = []           # Sort keys of due_order, to bisect
+# HTTP counters (shared by every download thread)
+http_stats = {"requests": 0, "retries": 0, "throttle_waits": 0, "bytes": 0}
+http_lock = threading.Lock()
+host_slots = {}              # Host to the semaphore that keeps requests to it at host_connections at most
+http_local = threading.local()  # Requests sent by each thread, so a span only counts the requests of its own thread
+# Profiling
+profile_spans = []                 # Finished spans, in the order they finished (only filled while profiling)
+profile_lock = threading.Lock()
+profile_start = time.perf_counter()  # Span start times are counted from here
+# Background refresh
+refresh_queue = queue.Queue()     # Messages from the background refresh to the gui
+refresh_thread = None             # Thread of the refresh currently in flight (None if there never was one)
+refresh_polling = False           # Whether a poll_refresh_queue() loop is scheduled (until it handles the refresh's result)
+refresh_cancel = threading.Event()  # Set to ask the refresh in flight to stop
+
+# -HTTP
+# Import canvasapi and requests (slow to load, so only done once Canvas is needed) and make CanvasAdapter
+def load_canvas_api():
+    global canvasapi
+    global CanvasAdapter
+    global RequestsConnectionError
+    global RequestsTimeout
+
+    if canvasapi is not None:  # Already loaded
+        return
+    from requests.adapters import HTTPAdapter  # to pool, retry and throttle the requests canvasapi makes (requests comes with canvasapi)
+    from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+    CanvasAdapter = type("CanvasAdapter", (HTTPAdapter,), {"send": canvas_adapter_send})
+    import canvasapi as api
+    canvasapi = api
+
+
+CanvasAdapter = None  # Made by load_canvas_api()
+RequestsConnectionError = RequestsTimeout = None  # Same
+
+
+# send() of CanvasAdapter, the transport adapter under canvasapi's requests session: a keep-alive connection pool as big
+# as the download pool, waits before requests when Canvas's rate limit runs low, and retries with exponential backoff on
+# throttling and transient errors. Canvas rate limits each token separately, so every account's session has its own adapter
+# that keeps its own remaining count (rate_limit_remaining). No more than host_connections requests go to one host at once, even from different
+# accounts' sessions. Every request, retry and throttle wait is counted in http_stats.
+def canvas_adapter_send(self, request, **kwargs):
+    slot = host_slot(urlsplit(request.url).netloc)
+    attempt = 0
+    while True:
+        throttle_wait(self)
+        try:
+            with slot:
+                response = super(CanvasAdapter, self).send(request, **kwargs)
+                size = len(response.content)  # Read the body while holding the slot
+        except (RequestsConnectionError, RequestsTimeout) as err:
+            if attempt >= MAX_RETRIES:
+                raise
+            print("Request failed (" + type(err).__name__ + "), retrying:", request.url)
+            attempt = retry_wait(attempt)
+            continue
+
+        with http_lock:
+            http_stats["requests"] += 1
+            http_stats["bytes"] += size
+        http_local.requests = thread_requests() + 1
+        note_rate_limit(self, response)
+        if attempt < MAX_RETRIES and is_retryable(response):
+            print("Request got", response.status_code, "from Canvas, retrying:", request.url)
+            response.close()
+            attempt = retry_wait(attempt)
+            continue
+        return response
+
+
+# Semaphore limiting requests to a host (made the first time the host is asked for)
+def host_slot(host):
+    with http_lock:
+        if host not in host_slots:
+            host_slots[host] = threading.BoundedSemaphore(host_connections)
+        return host_slots[host]
+
+
+# Check if a response is worth retrying: Canvas throttled it (403 with a rate limit message, or 429) or the server hiccuped
+def is_retryable(response):
+    if response.status_code == 403:
+        return "Rate Limit Exceeded" in response.text
+    return response.status_code in (429, 500, 502, 503, 504)
+
+
+# Remember how much of an adapter's (account's) rate limit Canvas says is left
+def note_rate_limit(adapter, response):
+    remaining = response.headers.get("X-Rate-Limit-Remaining")
+    if remaining is not None:
+        try:
+            adapter.rate_limit_remaining = float(remaining)
+        except ValueError:  # Not a number, ignore it
+            pass
+
+
+# Wait before a request if an adapter's (account's) rate limit is running low (longer the closer it is to running out)
+def throttle_wait(adapter):
+    remaining = adapter.rate_limit_remaining
+    if remaining is not None and remaining < THROTTLE_LOW:
+        with http_lock:
+            http_stats["throttle_waits"] += 1
+        time.sleep(THROTTLE_MAX_WAIT * (THROTTLE_LOW - max(remaining, 0.0)) / THROTTLE_LOW)
+
+
+# Wait out an exponential backoff (with some jitter so threads don't retry in lockstep) and return the next attempt number
+def retry_wait(attempt):
+    with http_lock:
+        http_stats["retries"] += 1
+    time.sleep(RETRY_BASE * 2 ** attempt + random.uniform(0, RETRY_BASE))
+    return attempt + 1
+
+
+# Put a CanvasAdapter under a Canvas object's requests session
+def manage_session(canvas):
+    try:
+        session = canvas._Canvas__requester._session  # canvasapi keeps its session private
+    except AttributeError:
+        print("Couldn't reach canvasapi's session, requests won't be pooled, retried or throttled")
+        return
+    adapter = CanvasAdapter(pool_connections=1, pool_maxsize=download_workers, pool_block=True)
+    adapter.rate_limit_remaining = None  # Last X-Rate-Limit-Remaining Canvas sent this session (None until it sends one)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+# Print the HTTP counters
+def print_http_stats():
+    print("HTTP:", http_stats["requests"], "requests,", http_stats["retries"], "retries,", http_stats["throttle_waits"], "throttle waits,",
+          http_stats["bytes"], "bytes")
+
+
+# Number of requests the current thread has sent
+def thread_requests():
+    return getattr(http_local, "requests", 0)
+
+
+# -Profiling
+# A named piece of work, timed while profiling is on (does nothing otherwise):
+#   with Span("save_data") as span:
+#       ...
+#       span.items = number of things it handled
+# Records how long it took, how many requests its thread sent during it and how many items it handled.
+# detail tells spans with the same name apart (like which course a get_assignments was for).
+class Span:
+    def __init__(self, name, detail=None):
+        self.name = name
+        self.detail = detail
+        self.items = None
+        self._start = None
+        self._requests = 0
+
+    def __enter__(self):
+        if profiling:
+            self._requests = thread_requests()
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._start is None:  # Profiling was off when the span started
+            return False
+        duration = time.perf_counter() - self._start
+        span = {"name": self.name, "detail": self.detail, "start": self._start - profile_start, "duration": duration,
+                "requests": thread_requests() - self._requests, "items": self.items,
+                "thread": threading.get_ident(), "thread_name": threading.current_thread().name}
+        with profile_lock:
+            profile_spans.append(span)
+        print("[profile]", span_label(span) + ":", str(round(duration, 4)), "seconds,", span["requests"], "requests,",
+              "-" if self.items is None else self.items, "items")
+        return False
+
+
+# Name of a span with its detail, if it has one
+def span_label(span):
+    return span["name"] if span["detail"] is None else span["name"] + " (" + str(span["detail"]) + ")"
+
+
+# Print every span name's count, total time, requests and items, slowest first
+def print_profile():
+    totals = {}
+    with profile_lock:
+        for span in profile_spans:
+            total = totals.setdefault(span["name"], {"count": 0, "duration": 0.0, "requests": 0, "items": 0})
+            total["count"] += 1
+            total["duration"] += span["duration"]
+            total["requests"] += span["requests"]
+            total["items"] += span["items"] or 0
+    print("Profile (span, times run, seconds, requests, items):")
+    for name, total in sorted(totals.items(), key=lambda item: item[1]["duration"], reverse=True):
+        print("  " + name.ljust(20), str(total["count"]).rjust(5), str(round(total["duration"], 4)).rjust(10),
+              str(total["requests"]).rjust(6), str(total["items"]).rjust(7))
+
+
+# Write every span to a file in the Chrome trace event format (opens in chrome://tracing or ui.perfetto.dev)
+def write_trace(path):
+    with profile_lock:
+        spans = list(profile_spans)
+    events = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+              for tid, name in {span["thread"]: span["thread_name"] for span in spans}.items()]
+    events += [{"name": span_label(span), "cat": span["name"], "ph": "X", "pid": os.getpid(), "tid": span["thread"],
+                "ts": round(span["start"] * 1e6), "dur": round(span["duration"] * 1e6),
+                "args": {"requests": span["requests"], "items": span["items"]}}
+               for span in sorted(spans, key=lambda span: span["start"])]
+    with open(path, "w") as file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+    print("Wrote", len(spans), "spans to", path)
+
+
+# Print the profile and write the trace, if profiling was on
+def finish_profile():
+    if not profiling:
+        return
+    print_profile()
+    if profile_trace_file is not None:
+        write_trace(profile_trace_file)
+
+
+# -Accounts
+# A Canvas account to download from: a base url and a token, signed in to the first time it's needed
+class Account:
+    def __init__(self, name, base_url, token):
+        self.name = name
+        self.base_url = base_url
+        self.token = token
+        self.instance = instance_of(base_url)  # Source its records are tagged with
+        self.signin = None                     # Canvas sign in (made by sign_in())
+        self.user = None                       # Signed in user (same)
+        self.lock = threading.Lock()           # So a background sign in and a refresh don't both sign in
+
+    def __str__(self):
+        return self.name + " (" + self.instance + ")"
+
+
+# Canvas instance a base url points to ('https://school.instructure.com/' is 'school.instructure.com')
+def instance_of(base_url):
+    return sys.intern(urlsplit(base_url if "//" in base_url else "//" + base_url).netloc.lower())  # Interned, so records share it with cached ones
+
+
+# Read the accounts to download from out of the environment, the first time they're needed. CANVIS_ACCOUNTS is a comma
+# separated list of names, each with a CANVIS_ACCOUNT_<NAME>_URL and CANVIS_ACCOUNT_<NAME>_TOKEN. Without it there's one
+# account, made from BASEURL and TOKEN.
+def canvas_accounts():
+    global accounts
+
+    if accounts is None:
+        names = [name.strip() for name in os.environ.get('CANVIS_ACCOUNTS', '').split(',') if name.strip()]
+        if len(names) == 0:
+            accounts = [Account("default", BASEURL, TOKEN)]
+        else:
+            accounts = []
+            for name in names:
+                prefix = "CANVIS_ACCOUNT_" + name.upper() + "_"
+                base_url, token = os.environ.get(prefix + "URL"), os.environ.get(prefix + "TOKEN")
+                if not base_url or not token:
+                    print("Account", name, "needs both", prefix + "URL and", prefix + "TOKEN, skipping it")
+                    continue
+                accounts.append(Account(name, base_url, token))
+    return accounts
+
+
+# Accounts to download from, raising an error that says what to set up if there are none (CANVIS_ACCOUNTS is set but
+# none of its accounts has both a url and a token)
+def download_accounts():
+    account_list = canvas_accounts()
+    if len(account_list) == 0:
+        raise ValueError("No Canvas account to download from: every account in CANVIS_ACCOUNTS needs "
+                         "CANVIS_ACCOUNT_<NAME>_URL and CANVIS_ACCOUNT_<NAME>_TOKEN")
+    return account_list
+
+
+# Sources (instances) of every account
+def account_sources():
+    return {account.instance for account in canvas_accounts()}
+
 
 # -Data
-print("Signing in...")
-# noinspection PyTypeChecker
-user = signin.get_user('self')  # Sign in as user
+# Sign in to an account (the first one if not given) the first time it's needed and return the user (cached data never needs it)
+def sign_in(account=None):
+    if account is None:
+        account = download_accounts()[0]
+    if account.user is None:
+        with account.lock:  # Anyone else signing in at the same time waits, then uses the same sign in
+            if account.user is None:
+                print("Signing in... (" + str(account) + ")")
+                with Span("signin", account.name):
+                    load_canvas_api()
+                    account.signin = canvasapi.Canvas(account.base_url, account.token)  # Sign in
+                    manage_session(account.signin)
+                    # noinspection PyTypeChecker
+                    account.user = account.signin.get_user('self')   # Sign in as user
+    return account.user
+
+
+# Sign in to every account on a worker thread while the gui shows cached data, so the first refresh doesn't have to wait for it
+def background_sign_in():
+    for account in canvas_accounts():
+        try:
+            print("Signed in to", account, "as", sign_in(account))
+        except Exception as err:  # Offline or bad token: the refresh will try again (and say so)
+            print("Couldn't sign in to", account, "in the background:", err)
 
 
-# Sort a 1D list of assignments into a 2D list of assignments sorted by date
+# Sort a 1D list of assignments into dates
 def sort_into_dates(asmts):
-    list_final = []     # The final list containing every assignment sorted
+    with Span("sort_into_dates") as span:
+        sorted_asmts = DateBuckets(asmts)
+        span.items = len(sorted_asmts.by_key)
+    return sorted_asmts
+
+
+# -- Cache --
+# Turn a datetime into text for the cache and back (None stays None)
+def to_iso(date):
+    return date.isoformat() if date is not None else None
+
+
+def from_iso(text):
+    return dt.datetime.fromisoformat(text) if text is not None else None
+
+
+# Open the cache database, creating its tables if they don't exist yet (one connection per call, so any thread can use it)
+# A cache from an older version is thrown away, it's only a copy of what's on Canvas
+def open_cache():
+    db = sqlite3.connect(CACHE_FILE)
+    if db.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+        db.executescript("""
+            DROP TABLE IF EXISTS courses;
+            DROP TABLE IF EXISTS assignments;
+            PRAGMA user_version = """ + str(CACHE_VERSION) + """;
+        """)
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS courses (
+            source TEXT, id INTEGER, name TEXT, course_code TEXT, start_at TEXT, end_at TEXT, synced_at TEXT, synced_from TEXT,
+            PRIMARY KEY (source, id));
+        CREATE TABLE IF NOT EXISTS assignments (
+            source TEXT, id INTEGER, course_id INTEGER, name TEXT, due_at TEXT, html_url TEXT, updated_at TEXT, PRIMARY KEY (source, id));
+        CREATE INDEX IF NOT EXISTS assignments_course ON assignments (source, course_id);
+    """)
+    return db
+
+
+# Read the cached courses of some sources (every source if sources is None), keyed with course key, along with when
+# each one was last synced: (synced_at, synced_from), see course_is_settled()
+def read_cached_courses(sources=None):
+    with closing(open_cache()) as db:
+        rows = db.execute("SELECT source, id, name, course_code, start_at, end_at, synced_at, synced_from FROM courses").fetchall()
+    rows = [(sys.intern(row[0]),) + row[1:] for row in rows if sources is None or row[0] in sources]
+    courses = {(row[0], row[1]): CourseRecord(row[0], row[1], row[2], row[3], from_iso(row[4]), from_iso(row[5])) for row in rows}
+    synced = {(row[0], row[1]): (from_iso(row[6]), from_iso(row[7])) for row in rows}
+    return courses, synced
+
+
+# Read the cached assignments of some courses (every course if course_keys is None), keyed with course key
+def read_cached_assignments(course_keys=None):
+    with closing(open_cache()) as db:
+        rows = db.execute("SELECT source, id, course_id, name, due_at, html_url, updated_at FROM assignments").fetchall()
+    by_course = {}
+    for row in rows:
+        if course_keys is None or (row[0], row[2]) in course_keys:
+            source = sys.intern(row[0])  # sqlite makes a new string for every row, but every record of a source can share one
+            by_course.setdefault((source, row[2]), []).append(AssignmentRecord(source, row[1], row[2], row[3], from_iso(row[4]), row[5], row[6]))
+    return by_course
+
+
+# Write downloaded courses and the assignments of the courses that were fetched to the cache
+# Only assignments that are new or whose updated_at changed are rewritten, and ones that disappeared from Canvas are dropped
+# If Canvas was only asked for assignments due in a (start, end) window (end may be None), cached ones outside it are left alone
+# courses is every course listed from the sources in listed_sources, so cached courses of those sources that aren't in it
+# (dropped, or filtered out by the listing query) are deleted along with their assignments
+def store_cache(courses, fetched_assignments, synced_at, window=None, listed_sources=()):
+    with closing(open_cache()) as db, db:  # Second "db" commits everything in one transaction
+        listed = {course.key for course in courses}
+        for source in listed_sources:
+            rows = db.execute("SELECT id FROM courses WHERE source = ?", (source,)).fetchall()
+            gone = [(source, row[0]) for row in rows if (source, row[0]) not in listed]
+            db.executemany("DELETE FROM assignments WHERE source = ? AND course_id = ?", gone)
+            db.executemany("DELETE FROM courses WHERE source = ? AND id = ?", gone)
+            if gone:
+                print("Dropped", len(gone), "courses no longer listed from", source, "from the cache")
+
+        for (source, course_id), asmts in fetched_assignments.items():
+            rows = db.execute("SELECT id, updated_at, due_at FROM assignments WHERE source = ? AND course_id = ?", (source, course_id)).fetchall()
+            cached = {row[0]: row[1] for row in rows}
+            in_window = {row[0] for row in rows if window is None or (row[2] is not None and window[0] <= from_iso(row[2])
+                                                                      and (window[1] is None or from_iso(row[2]) <= window[1]))}
+            changed = [asmt for asmt in asmts if asmt.id not in cached or cached[asmt.id] != asmt.updated_at]
+            gone = [(source, asmt_id) for asmt_id in in_window - {asmt.id for asmt in asmts}]
+            db.executemany("INSERT OR REPLACE INTO assignments VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           [(asmt.source, asmt.id, asmt.course_id, asmt.name, to_iso(asmt.due_at_date), asmt.html_url, asmt.updated_at)
+                            for asmt in changed])
+            db.executemany("DELETE FROM assignments WHERE source = ? AND id = ?", gone)
+            print("Cached", len(changed), "changed and dropped", len(gone), "removed assignments of course", course_id, "from", source)
+
+        # Only fetched courses get a new sync time, the others keep the one they had. Along with it goes the earliest due
+        # date that sync asked for (NULL if it asked for everything), so a partial sync doesn't count as a full one.
+        synced_from = to_iso(window[0]) if window is not None else None
+        db.executemany("""
+            INSERT INTO courses VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (source, id) DO UPDATE SET name = excluded.name, course_code = excluded.course_code, start_at = excluded.start_at,
+                end_at = excluded.end_at, synced_at = COALESCE(excluded.synced_at, courses.synced_at),
+                synced_from = CASE WHEN excluded.synced_at IS NULL THEN courses.synced_from ELSE excluded.synced_from END
+        """, [(course.source, course.id, course.name, course.course_code, to_iso(course.start_at_date), to_iso(course.end_at_date))
+              + ((to_iso(synced_at), synced_from) if course.key in fetched_assignments else (None, None))
+              for course in courses])
+
+
+# Check if a course's cached assignments are still good: it ended before the last time it was synced, so nothing will change,
+# and that sync asked for everything the cutoff lets in. synced is (synced_at, synced_from) from read_cached_courses(), or
+# None if it was never synced. synced_from is the earliest due date the sync asked Canvas for (None if it asked for all)
+def course_is_settled(course, synced):
+    if synced is None:
+        return False
+    synced_at, synced_from = synced
+    return (synced_at is not None and course.end_at_date is not None and course.end_at_date < synced_at
+            and (synced_from is None or synced_from <= assignment_lower_cutoff))
+
+
+# -- User data --
+# Parse one line of the legacy data file, falling back to an empty value of the right type if it's invalid
+def parse_legacy_line(data_lines, line, empty_of_type, data_name):
+    try:                                                 # Try to parse data in line (will fail if file data is invalid, or raise an error if wrong type)
+        read_data = ast.literal_eval(data_lines[line])   # Attempt to parse and record data from line (may fail if input is invalid)
+        if type(read_data) != type(empty_of_type):       # Make sure data is the right type
+            raise TypeError(data_name, "must be stored in a(n)", str(type(empty_of_type)), "but data is", str(type(read_data)))  # Raise an error if not
+
+    except SyntaxError as err:                              # If the data is invalid
+        print("Failed to parse", data_name, "from line", str(line) + ". Defaulting to empty", str(type(empty_of_type)) + ".\nDetails:", err.msg)
+        read_data = empty_of_type                               # Reset data to empty
+
+    except (TypeError, ValueError):                         # If the data is wrong type (or not a literal at all)
+        print(data_name, "not stored as a", str(type(empty_of_type)) + ". Defaulting to empty", str(type(empty_of_type)) + ".")
+        read_data = empty_of_type                               # Reset data to empty
+
+    return read_data  # Return data
+
+
+# Move the data of a legacy canvis.dat file (ignored ids list on line 0, nicknames dict on line 1) into the data file
+# The ids in it are from the default account's instance, the only one older versions could use
+def migrate_legacy_data(db):
+    if not os.path.exists(LEGACY_DATA_FILE):
+        return
+    print("Migrating", LEGACY_DATA_FILE, "to", DATA_FILE)
+    with open(LEGACY_DATA_FILE, "r") as legacy_file:
+        data_lines = legacy_file.read().splitlines()  # Read data file and split into list (without newline symbols)
+    while len(data_lines) < 2:  # Make sure data has enough lines
+        data_lines.append("")
+
+    source = instance_of(BASEURL)
+    db.executemany("INSERT OR IGNORE INTO ignored VALUES (?, ?)",
+                   [(source, asmt_id) for asmt_id in parse_legacy_line(data_lines, 0, [], "ignored assignment ids")])
+    db.executemany("INSERT OR REPLACE INTO nicknames VALUES (?, ?, ?)",
+                   [(source, asmt_id, nname) for asmt_id, nname in parse_legacy_line(data_lines, 1, {}, "assignment nicknames").items()])
+
+
+# Make the data tables if they don't exist yet (one statement at a time, executescript() would commit the migration half way)
+def create_data_tables(db):
+    db.execute("CREATE TABLE IF NOT EXISTS ignored (source TEXT, id INTEGER, PRIMARY KEY (source, id))")
+    db.execute("CREATE TABLE IF NOT EXISTS nicknames (source TEXT, id INTEGER, nickname TEXT, PRIMARY KEY (source, id))")
+
+
+# Open the data file, creating it (and moving any legacy data into it) the first time
+def open_data():
+    db = sqlite3.connect(DATA_FILE)
+    db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+    version = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    if version is None:
+        # New data file: bring over the old one in the same transaction as the version, so a crash can't half-migrate it
+        with db:
+            create_data_tables(db)
+            migrate_legacy_data(db)
+            db.execute("INSERT INTO meta VALUES ('version', ?)", (DATA_VERSION,))
+        if os.path.exists(LEGACY_DATA_FILE):
+            os.replace(LEGACY_DATA_FILE, LEGACY_DATA_FILE + ".migrated")  # Keep it around, but don't migrate it twice
+    else:
+        if version[0] > DATA_VERSION:
+            print(DATA_FILE, "was written by a newer version of this program (data version", str(version[0]) + "), some data may be ignored")
+        create_data_tables(db)
+    return db
 
-    for asmt in asmts:  # Sort every assignment
-        assignment_time = asmt.due_at_date.astimezone().date()  # Get assignment due time
 
-        # Check for fitting date
-        for date in list_final:                     # Check every list in included assignments
-            if date[0] == assignment_time:              # If the assignment's date matches up with the list
-                if asmt not in date[1:]:                    # If the assignment isn't already in the list
-                    date.append(asmt)                           # Add it to the list
-                break                                       # Stop checking lists
+# Read ignored assignment keys (set) and assignment nicknames (dict keyed with assignment key) from the data file
+def read_data():
+    with closing(open_data()) as db:
+        read_ignored = {(row[0], row[1]) for row in db.execute("SELECT source, id FROM ignored")}
+        read_nnames = {(row[0], row[1]): row[2] for row in db.execute("SELECT source, id, nickname FROM nicknames")}
+    return read_ignored, read_nnames
 
-        else:                                       # If it's done checking but a matching date wasn't found
-            list_final.append([assignment_time, asmt])  # Append a new list for the new date with assignment
 
-    return list_final   # Return filled out list
+# -- Filtering --
+# Split courses with start dates into a dict of included courses (keyed with course id) and a list of past-due courses
+def split_courses(courses):
+    starting_courses = [course for course in courses if course.start_at_date is not None]  # List of courses with start dates
 
+    # Sort course into included and past-due lists 
+    split_inc = {course.key: course for course in starting_courses if course.start_at_date >= course_lower_cutoff}  # 1D dict of assignments on or past cutoff date
+    split_pd = [course for course in starting_courses if course.start_at_date < course_lower_cutoff]               # List of assignments before cutoff date
+    return split_inc, split_pd
 
-# Download and date assignments
-def refresh_assignments(print_on_completion=False):
-    # Declare globals (why does python do this it's already bad practice shadowing globals)
-    global inc_courses
-    global pd_courses
-    global inc_assignments
-    global pd_assignments
+
+# Index in due_order of the first assignment due at or after a cutoff (everything before it is past due)
+def cutoff_index(cutoff):
+    return bisect.bisect_left(due_keys, (cutoff.timestamp(),))  # (time,) sorts before every (time, source, id) key due at that time
+
+
+# Split assignments into included and past-due lists by due date
+def split_assignments(asmts):
+    split_inc = [asmt for asmt in asmts if asmt.due_at_date >= assignment_lower_cutoff]  # 1D list of assignments on or past cutoff date
+    split_pd = [asmt for asmt in asmts if asmt.due_at_date < assignment_lower_cutoff]    # List of assignments before cutoff date
+    return split_inc, split_pd
+
+
+# Sort included assignments into dates and package everything up the way apply_download() wants it
+def package_assignments(new_inc_courses, new_pd_courses, inc_as1d, new_pd_assignments):
+    # Sort included assignments into dates
+    print("Sorting assignments into dates")
+    new_inc_assignments = sort_into_dates(inc_as1d)   # Sort the 1D list of included assignments into dates
+
+    return {"inc_courses": new_inc_courses, "pd_courses": new_pd_courses,
+            "inc_assignments": new_inc_assignments, "pd_assignments": new_pd_assignments,
+            "synced_sources": set()}  # Sources downloaded completely (set by download_assignments())
+
+
+# -- Download --
+# Query parameters for courses, letting Canvas drop courses the user isn't enrolled in anymore (filtered again locally either way)
+def course_query():
+    query = {"per_page": PAGE_SIZE}
+    if course_enrollment_state:
+        query["enrollment_state"] = course_enrollment_state
+    return query
+
+
+# Query parameters for assignments. Canvas can't filter by an arbitrary due date, but if the cutoff hasn't passed yet
+# the 'future' bucket drops everything due before now (which the cutoff would drop anyway), along with undated ones.
+def assignment_query():
+    query = {"per_page": PAGE_SIZE, "order_by": "due_at"}
+    if assignment_lower_cutoff >= dt.datetime.now(dt.timezone.utc):
+        query["bucket"] = "future"
+    return query
+
+
+# Sign in to an account and get its courses as (record, canvasapi Course) pairs (runs on a worker thread)
+def download_courses(account):
+    canvas_user = sign_in(account)
+    print("Getting courses... (" + str(account) + ")")
+    with Span("get_courses", account.name) as span:
+        listed = [(course_record(course, account.instance), course) for course in canvas_user.get_courses(**course_query())]
+        span.items = len(listed)
+    return listed
+
+
+# Get one course's assignments with due dates as records (runs on a worker thread)
+# course is the course's record, canvas_course the canvasapi Course it was made from (used to ask Canvas)
+# Returns the assignments and whether they came from Canvas (True) or from the cache (False)
+def download_course_assignments(course, canvas_course, cached_assignments, synced, query):
+    if course_is_settled(course, synced):
+        # Course is over and was synced after it ended, no need to ask Canvas again
+        print("Using cached assignments... (" + str(course) + ")")
+        return cached_assignments.get(course.key, []), False
+
+    print("Getting assignments... (" + str(course) + ")")
+    with Span("get_assignments", course) as span:
+        assignments = canvas_course.get_assignments(**query)  # Get assignments (pages are pulled as they're read, on the worker thread)
+        records = [assignment_record(asmt, course.source) for asmt in assignments if hasattr(asmt, "due_at_date")]  # Records of assignments with due dates
+        span.items = len(records)
+    return records, True
+
+
+# Run download(*args) for every args in jobs on a download pool, returning the results in job order (so merges are
+# deterministic) or None if cancel gets set. report is called with (done, total) jobs as they finish.
+def run_downloads(pool, download, jobs, cancel=None, report=None):
+    total = len(jobs)
+    if report is not None:
+        report(0, total)
+    futures = [pool.submit(download, *args) for args in jobs]
+    for done, _ in enumerate(as_completed(futures), 1):  # Wait for jobs as they finish
+        if cancel is not None and cancel.is_set():          # If the download was cancelled,
+            for future in futures:                              # Drop the jobs that haven't started
+                future.cancel()
+            print("---- Data download cancelled ----")
+            return None
+        if report is not None:
+            report(done, total)
+    return [future.result() for future in futures]
+
+
+# Run download(*args) and return what it returns, or the error it raised if it fails, so one account or course failing
+# doesn't stop the others (runs on a worker thread)
+def try_download(download, *args):
+    try:
+        return download(*args)
+    except Exception as err:
+        return err
+
+
+# Turn the assignment json Canvas sends (inside calendar events) into an assignment record
+def assignment_from_json(data, source):
+    due_at = data.get("due_at")
+    return AssignmentRecord(source, data["id"], data["course_id"], data["name"],
+                            from_iso(due_at.replace("Z", "+00:00")) if due_at else None, data["html_url"], data.get("updated_at"))
+
+
+# Get the assignments of up to CALENDAR_CONTEXTS courses of an account due in a window with one paginated calendar
+# listing (runs on a worker thread)
+def download_calendar_chunk(account, courses, window):
+    print("Getting calendar assignments... (" + ", ".join(str(course) for course in courses) + ")")
+    sign_in(account)
+    with Span("get_calendar_events", account.name + ": " + ", ".join(str(course.id) for course in courses)) as span:
+        events = account.signin.get_calendar_events(type="assignment", context_codes=["course_" + str(course.id) for course in courses],
+                                                    start_date=window[0].isoformat(), end_date=window[1].isoformat(), per_page=PAGE_SIZE)
+        asmts = {}
+        for event in events:  # An assignment with overrides shows up once per override, so keep one per id
+            data = getattr(event, "assignment", None)
+            if data is not None and data.get("due_at"):
+                asmts.setdefault(data["id"], assignment_from_json(data, account.instance))
+        span.items = len(asmts)
+    return list(asmts.values())
+
+
+# Download, filter and date the assignments of every account without touching any globals or the gui, so it can run on
+# a background thread. Every account's requests share one pool, so all of them together stay under download_workers.
+# cancel is a threading.Event that stops the download early (None is returned), report is called with (done, total) downloads
+def download_assignments(cancel=None, report=None):
+    with ThreadPoolExecutor(max_workers=download_workers) as pool:
+        return download_with(pool, cancel, report)
+
+
+# download_assignments() on a given pool
+def download_with(pool, cancel=None, report=None):
     # Refresh assignments
     print("Refreshing assignments:")
+    sync_time = dt.datetime.now(dt.timezone.utc)  # Anything Canvas changes after this point is picked up next sync
 
-    # Get data
-    print("Getting courses...")
-    courses = user.get_courses()  # Get user courses
+    # Get data (a course two accounts on the same instance are both in is only kept once)
+    account_list = download_accounts()
+    print("Getting courses from", len(account_list), "accounts...")
+    listings = run_downloads(pool, try_download, [(download_courses, account) for account in account_list], cancel)
+    if listings is None:
+        return None
+    if all(isinstance(listed, Exception) for listed in listings):  # Nothing to show but the cache, so let the caller report it
+        raise listings[0]
+    with Span("read_cache") as span:
+        cached_courses, synced = read_cached_courses()
+        span.items = len(cached_courses)
+    unlisted = set()     # Sources an account couldn't list the courses of (their cached courses are used, and kept)
+    incomplete = set()   # Sources that didn't download completely (their ignored assignments aren't pruned)
+    canvas_courses = {}  # Course key to the account and canvasapi Course to ask for its assignments with
+    records = {}         # Course key to course
+    for account, listed in zip(account_list, listings):
+        if isinstance(listed, Exception):
+            print("Couldn't get courses from", str(account) + ":", listed, "- using cached data for it")
+            unlisted.add(account.instance)
+            continue
+        for record, canvas_course in listed:
+            if record.key not in records:
+                records[record.key] = record
+                canvas_courses[record.key] = (account, canvas_course)
+    courses = list(records.values())  # Listed courses (the only ones the cache is updated with)
+    for key, course in cached_courses.items():
+        if key[0] in unlisted and key not in records:
+            records[key] = course
+    incomplete |= unlisted
 
     # Check if start time in within timeframe for each course
     print("Filtering courses")
-    starting_courses = [course for course in courses if course.start_at_date is not None]  # List of courses with start dates
-
-    # Sort course into included and past-due lists 
-    inc_courses = {course.id: course for course in starting_courses if course.start_at_date >= course_lower_cutoff}  # 1D dict of assignments on or past cutoff date
-    pd_courses = [course for course in starting_courses if course.start_at_date < course_lower_cutoff]               # List of assignments before cutoff date
+    with Span("filter_courses") as span:
+        new_inc_courses, new_pd_courses = split_courses(records.values())
+        span.items = len(records)
 
     # Print included courses
     print("Included courses:")
-    for c_id, course in inc_courses.items():
+    for c_id, course in new_inc_courses.items():
         print(course)
 
     # Print excluded courses
     '''print("Excluded courses:")
-    for course in pd_courses:
+    for course in new_pd_courses:
         print(course)'''
     print()
 
+    # Look up what the cache already knows
+    with Span("read_cache") as span:
+        cached_assignments = read_cached_assignments(set(new_inc_courses.keys()))
+        span.items = sum(len(asmts) for asmts in cached_assignments.values())
+
+    # Courses that aren't asked for come from the cache: settled ones, and ones of accounts that couldn't be listed
+    if fetch_strategy == "calendar":
+        # The rest are asked for a few at a time (per account) through the calendar
+        from_cache = {course.key for course in new_inc_courses.values()
+                      if course.key not in canvas_courses or course_is_settled(course, synced.get(course.key))}
+        chunks = []
+        for account in account_list:
+            to_fetch = [course for course in new_inc_courses.values() if course.key not in from_cache and canvas_courses[course.key][0] is account]
+            chunks += [(account, to_fetch[i:i + CALENDAR_CONTEXTS]) for i in range(0, len(to_fetch), CALENDAR_CONTEXTS)]
+        window = (assignment_lower_cutoff, sync_time + dt.timedelta(days=CALENDAR_DAYS))  # What Canvas was asked for (the cache
+        # keeps its start with each course, so an ended course is only settled for cutoffs from there on)
+        print("Getting assignments from", len(new_inc_courses) - len(from_cache), "courses in", len(chunks), "calendar listings,",
+              len(from_cache), "from cache...")
+        results = run_downloads(pool, try_download, [(download_calendar_chunk, account, chunk, window) for account, chunk in chunks], cancel, report)
+        if results is None:
+            return None
+        by_course = {course.key: [] for course in new_inc_courses.values() if course.key not in from_cache}
+        for (account, chunk), asmts in zip(chunks, results):
+            if isinstance(asmts, Exception):  # Those courses fall back to the cache
+                print("Couldn't get calendar assignments from", str(account) + ":", asmts, "- using cached data for",
+                      ", ".join(str(course) for course in chunk))
+                incomplete.add(account.instance)
+                for course in chunk:
+                    del by_course[course.key]
+                continue
+            for asmt in asmts:
+                by_course.setdefault(asmt.course_key, []).append(asmt)
+        course_results = [(by_course[course.key], True) if course.key in by_course else (cached_assignments.get(course.key, []), False)
+                          for course in new_inc_courses.values()]
+    else:
+        # Download every included course's assignments at once
+        to_fetch = [course for course in new_inc_courses.values() if course.key in canvas_courses]
+        print("Getting assignments from", len(to_fetch), "courses (" + str(download_workers), "at a time)...")
+        query = assignment_query()
+        window = (sync_time, None) if "bucket" in query else None  # What Canvas was asked for, so the cache knows what's missing on purpose
+        results = run_downloads(pool, try_download,
+                                [(download_course_assignments, course, canvas_courses[course.key][1], cached_assignments, synced.get(course.key), query)
+                                 for course in to_fetch],
+                                cancel, report)
+        if results is None:
+            return None
+        fetched_results = {}
+        for course, result in zip(to_fetch, results):
+            if isinstance(result, Exception):  # That course falls back to the cache
+                print("Couldn't get assignments of", str(course) + ":", result, "- using cached data for it")
+                incomplete.add(course.source)
+                continue
+            fetched_results[course.key] = result
+        course_results = [fetched_results.get(course.key, (cached_assignments.get(course.key, []), False)) for course in new_inc_courses.values()]
+
+    # Save what was fetched so the next launch (and offline refreshes) can use it
+    print("Updating cache")
+    fetched = {course.key: asmts for course, (asmts, from_canvas) in zip(new_inc_courses.values(), course_results) if from_canvas}
+    with Span("store_cache") as span:
+        store_cache(courses, fetched, sync_time, window, {account.instance for account in account_list} - unlisted)
+        span.items = sum(len(asmts) for asmts in fetched.values())
+
+    # Merge the results of every course
     inc_as1d = []
-    # Check if due time in within timeframe for each assignment
-    for course_id, course in inc_courses.items():
-        # Get and filter assignments by date
-        print("Getting assignments... (" + str(course) + ")")
-        assignments = course.get_assignments()                # Get assignments
-
-        print("Filtering out early assignments by due date")
-        due_assignments = [asmt for asmt in assignments if hasattr(asmt, "due_at_date")]                    # List of assignments with due dates
-        # Sort assignments into included and past-due lists
-        inc_as1d += [asmt for asmt in due_assignments if asmt.due_at_date >= assignment_lower_cutoff]       # 1D list of assignments on or past cutoff date
-        pd_assignments = [asmt for asmt in due_assignments if asmt.due_at_date < assignment_lower_cutoff]   # List of assignments before cutoff date
+    new_pd_assignments = []
+    with Span("filter_assignments") as span:
+        for asmts, _ in course_results:
+            course_inc, course_pd = split_assignments(asmts)
+            inc_as1d += course_inc
+            new_pd_assignments += course_pd
+        span.items = len(inc_as1d) + len(new_pd_assignments)
 # SPLIT UP THE FILTERING AND SORTING OF NEW ASSIGNMENTS INTO ITS OWN FUNCTION SO THAT IT CAN BE CALLED AFTER REFRESH_DATA()
-    # Sort included assignments into dates
-    print("Sorting assignments by dates")
-    inc_as1d.sort(key=lambda asmt: asmt.due_at_date)  # Sort the assignments in the 1D list
-    print("Sorting assignments into dates")
-    inc_assignments = sort_into_dates(inc_as1d)       # Sort the 1D list of included assignments into the 2D date one
-
+    result = package_assignments(new_inc_courses, new_pd_courses, inc_as1d, new_pd_assignments)
+    result["synced_sources"] = {account.instance for account in account_list} - incomplete
+    print_http_stats()
     print("---- Finished data download and sort ----")
-    refresh_data(True, True)
+    return result
+
+
+# Load, filter and date assignments from the cache alone (no network)
+def load_cache():
+    print("Loading cached data:")
+    with Span("read_cache") as span:
+        cached_courses, _ = read_cached_courses(account_sources())  # Only courses of accounts still set up
+        new_inc_courses, new_pd_courses = split_courses(cached_courses.values())
+        cached_assignments = read_cached_assignments(set(new_inc_courses.keys()))
+        span.items = sum(len(asmts) for asmts in cached_assignments.values())
+
+    inc_as1d = []
+    new_pd_assignments = []
+    with Span("filter_assignments") as span:
+        for course_key in new_inc_courses.keys():  # Go in course order, like a download does
+            course_inc, course_pd = split_assignments(cached_assignments.get(course_key, []))
+            inc_as1d += course_inc
+            new_pd_assignments += course_pd
+        span.items = len(inc_as1d) + len(new_pd_assignments)
+    result = package_assignments(new_inc_courses, new_pd_courses, inc_as1d, new_pd_assignments)
+    print("---- Finished cache load ----")
+    return result
+
+
+# Replace the current assignment data with the result of download_assignments() or load_cache() and refresh (must run on
+# the gui thread). remove_unused drops ignored keys that match no assignment, so it's only for complete downloads: the
+# cache can be empty or behind, and its gaps aren't assignments that went away.
+def apply_download(result, remove_unused=True):
+    # Declare globals (why does python do this it's already bad practice shadowing globals)
+    global inc_courses
+    global pd_courses
+    global inc_assignments
+    global pd_assignments
+    global exc_assignments
+    global due_order
+    global due_keys
+
+    inc_courses = result["inc_courses"]
+    pd_courses = result["pd_courses"]
+    inc_assignments = result["inc_assignments"]
+    exc_assignments = {}  # Old excluded assignments are stale, refresh_data() sorts the new ones back out
+
+    # Line every assignment up by due time, so later cutoff changes only move the ones between the old and new cutoff
+    due_order = sorted(inc_assignments.assignments() + result["pd_assignments"], key=DateBuckets.sort_key)
+    due_keys = [DateBuckets.sort_key(asmt) for asmt in due_order]
+    cut = cutoff_index(assignment_lower_cutoff)
+    pd_assignments = due_order[:cut]
+    if cut != len(result["pd_assignments"]):  # The cutoff changed while downloading
+        inc_assignments = sort_into_dates(due_order[cut:])
+    refresh_data(remove_unused, True, result["synced_sources"])
+
+
+# Download and date assignments
+def refresh_assignments(print_on_completion=False):
+    apply_download(download_assignments())
     if print_on_completion:
         print_assignments()
 
 
+# Run download_assignments() on a worker thread, sending its progress and result back through refresh_queue
+def refresh_worker():
+    try:
+        result = download_assignments(refresh_cancel, lambda done, total: refresh_queue.put(("progress", done, total)))
+        refresh_queue.put(("done", result))
+    except Exception as err:  # Anything going wrong in the download is reported to the gui instead of killing the thread silently
+        refresh_queue.put(("error", err))
+
+
 # Refresh assignments by filters
-def refresh_data(remove_unused=True, read_file=True):  # remove_unused should be true whenever refreshing for the current date, also add a little notice that assignments won't be ignored if due before present date
+# sources limits which sources' ignored keys remove_unused can drop (every source if None), so an account that failed to
+# download doesn't lose its ignores
+def refresh_data(remove_unused=True, read_file=True, sources=None):  # remove_unused should be true whenever refreshing for the current date, also add a little notice that assignments won't be ignored if due before present date
     # Declare globals
     global ignored_assignments
     global inc_assignments
     global exc_assignments
     global assignment_nnames
-    global dataFile
-    global listbox_dates
-    global list_dates
     # Refresh filters and other file data
     print("Refreshing data:")
+    if refresh_time_key():  # Dates are rebuilt below either way, this just makes sure they use the current time zone
+        print("Time zone changed, re-dating assignments")
 
     # If it should overwrite current data with data from file
     if read_file:
         # Read file data
         print("Reading data file...")
-        dataFile = open("canvis.dat", "r")          # Open data file for reading
-        data_lines = dataFile.read().splitlines()   # Read data file and split into list (without newline symbols)
-        dataFile.close()                            # Close data file
-        # Make sure file has enough lines
-        while len(data_lines) < 3:  # While data has too few lines (CURRENTLY EXPECTING: 3 LINES)
-            data_lines.append("")   # Append data list with empty string
-
-        # Define code that parses the data from a line
-        def parseline(line, empty_of_type, data_name):
-            try:                                                 # Try to parse data in line (will fail if file data is invalid, or raise an error if wrong type)
-                read_data = ast.literal_eval(data_lines[line])   # Attempt to parse and record data from line (may fail if input is invalid)
-                if type(read_data) != type(empty_of_type):       # Make sure data is the right type
-                    raise TypeError(data_name, "must be stored in a(n)", str(type(empty_of_type)), "but data is", str(type(read_data)))  # Raise an error if not
-
-            except SyntaxError as err:                              # If the data is invalid
-                print("Failed to parse", data_name, "from line", str(line) + ". Defaulting to empty", str(type(empty_of_type)) + ".\nDetails:", err.msg)
-                read_data = empty_of_type                               # Reset data to empty
-
-            except TypeError:                                       # If the data is wrong type
-                print(data_name, "not stored as a", str(type(empty_of_type)) + ". Defaulting to empty", str(type(empty_of_type)) + ".")
-                read_data = empty_of_type                               # Reset data to empty
-
-            return read_data  # Return data
-
-        # Get ignored assignment ids from file (list at line 0)
-        print("Reading ignored assignments")
-        ignored_assignments = parseline(0, [], "ignored assignment ids")  # Record list of ignored assignment ids
-
-        # Get assignment nicknames from file (dict at line 1)
-        print("Getting assignment nicknames")
-        assignment_nnames = parseline(1, {}, "assignment nicknames")
-
-        # Get date settings from file (dict at line 1)
-        print("Getting assignment nicknames")
-        assignment_nnames = parseline(1, {}, "assignment nicknames")
+        with Span("read_data") as span:
+            ignored_assignments, assignment_nnames = read_data()
+            span.items = len(ignored_assignments) + len(assignment_nnames)
+        # Changes that aren't saved yet (made while a download ran, or just not saved) go back on top of what was read,
+        # and stay pending until save_data() writes them
+        for key, added in pending_ignores.items():
+            if added:
+                ignored_assignments.add(key)
+            else:
+                ignored_assignments.discard(key)
+        for key, nname in pending_nnames.items():
+            if nname is None:
+                assignment_nnames.pop(key, None)
+            else:
+                assignment_nnames[key] = nname
 
     # -- Filter ignored assignments
     # Filter assignments in/out using ignored assignment list
     print("Removing ignored assignments")
 
     # Collect all assignments, sort into included and excluded by ids using ignored
-    all_assignments = [asmt for date in inc_assignments for asmt in date[1:]] + exc_assignments  # Get all assignments
-    if show_all.get() or len(ignored_assignments) == 0:
+    all_assignments = inc_assignments.assignments() + list(exc_assignments.values())  # Get all assignments
+    showing_all = tk_root is not None and show_all.get()  # 'Show all' is only a gui setting
+    if showing_all or len(ignored_assignments) == 0:
         # If to show all assignments/not removing any assignments
-        inc_assignments = sort_into_dates(all_assignments)  # Sort the 1D list of all assignments into the 2D date one
+        inc_assignments = sort_into_dates(all_assignments)  # Sort the 1D list of all assignments into dates
+        exc_assignments = {}
     else:
-        # If to filter assignments
-        inc_as1d = [asmt for asmt in all_assignments if asmt.id not in ignored_assignments]     # Get included assignments (id not on ignore list)
-        exc_assignments = [asmt for asmt in all_assignments if asmt.id in ignored_assignments]  # Get excluded assignments (id is on ignore list)
-        inc_assignments = sort_into_dates(inc_as1d)                                             # Sort the 1D list of included assignments into the 2D date one
+        # If to filter assignments (ignored keys are a set, so each check is a single lookup)
+        with Span("filter_ignored") as span:
+            inc_as1d = []
+            exc_assignments = {}
+            for asmt in all_assignments:
+                key = asmt.key
+                if key in ignored_assignments:
+                    exc_assignments[key] = asmt  # Excluded assignment (key is on ignore list)
+                else:
+                    inc_as1d.append(asmt)        # Included assignment (key not on ignore list)
+            span.items = len(all_assignments)
+        inc_assignments = sort_into_dates(inc_as1d)                                                       # Sort the 1D list of included assignments into dates
 
         # Filter out unused ignored ids (if intended)
-        if remove_unused:                                                                       # If unused ignored ids should be removed
-            all_ids = [asmt.id for asmt in all_assignments]                                         # Get all assignment ids
-            ignored_unused = [rem_id for rem_id in ignored_assignments if rem_id not in all_ids]    # Get all ignore ids not matching an assignment
-            for rem_id in ignored_unused:                                                           # For every unused ignore id,
-                ignored_assignments.remove(rem_id)                                                      # Remove it
-
-    # Apply new entries to date listbox
-    listbox_dates.delete(0, len(list_dates.get())-1)                      # Remove old entries
-    entries = [date[0].strftime('%m/%d/%y') for date in inc_assignments]  # Create list of dates
-    list_dates = StringVar(value=entries)                                 # Update list of dates
-    for i, entry in enumerate(entries):                                   # Reinsert new dates into listbox
-        listbox_dates.insert(i, entry)
+        if remove_unused:                                                   # If unused ignored ids should be removed
+            unused = ignored_assignments - {asmt.key for asmt in all_assignments} - {asmt.key for asmt in pd_assignments}  # Get all ignore keys not matching an assignment (past due ones still count, the cutoff can come back to them)
+            if sources is not None:
+                unused = {key for key in unused if key[0] in sources}               # Only of sources that were downloaded completely
+            ignored_assignments -= unused                                           # Remove them
+            pending_ignores.update(dict.fromkeys(unused, False))
+
+    # Apply new entries to listboxes
+    if tk_root is not None:
+        render_date_list()
     print("---- Finished data refresh ----")
 
 
+# Save only what changed since the last save, in one transaction
 def save_data():
-    # Declare globals
-    global dataFile
     print("Saving file data:")
 
-    # Update data
-    data_lines = (str(ignored_assignments), str(assignment_nnames))  # The lines of data to go in the file, in a single string
-
-    print("Rewriting to file")
-    # Write new data to file
-    dataFile = open("canvis.dat", "w")  # Open data file for overwriting
-    dataFile.write("\n".join(data_lines))  # Write new data to file as a string
-    dataFile.close()  # Close data file
+    print("Writing", len(pending_ignores) + len(pending_nnames), "changes to file")
+    with Span("save_data") as span, closing(open_data()) as db, db:  # Second "db" commits everything at once, or nothing if something fails
+        db.executemany("INSERT OR IGNORE INTO ignored VALUES (?, ?)", [key for key, added in pending_ignores.items() if added])
+        db.executemany("DELETE FROM ignored WHERE source = ? AND id = ?", [key for key, added in pending_ignores.items() if not added])
+        db.executemany("INSERT OR REPLACE INTO nicknames VALUES (?, ?, ?)", [key + (nname,) for key, nname in pending_nnames.items() if nname is not None])
+        db.executemany("DELETE FROM nicknames WHERE source = ? AND id = ?", [key for key, nname in pending_nnames.items() if nname is None])
+        span.items = len(pending_ignores) + len(pending_nnames)
+    pending_ignores.clear()
+    pending_nnames.clear()
     print("---- Finished filedata save ----")
 
 
 def print_assignments():  # Print included assignments
     nname_keys = assignment_nnames.keys()
     print("\nAssignments after date " + str(assignment_lower_cutoff) + ":")
-    for date in inc_assignments:  # Print something for every date
-        print("\nAssignments on date: " + date[0].isoformat())
-        for asmt in date[1:]:
-            if asmt.id in nname_keys:
-                print("ASSIGNMENT -", assignment_nnames[asmt.id], "(nickname) - FROM COURSE -", str(inc_courses[asmt.course_id]), "- DUE AT -", asmt.due_at_date.astimezone().strftime("%m/%d/%Y, %H:%M:%S"))
+    for date, bucket in inc_assignments:  # Print something for every date
+        print("\nAssignments on date: " + date.isoformat())
+        for asmt in bucket:
+            if asmt.key in nname_keys:
+                print("ASSIGNMENT -", assignment_nnames[asmt.key], "(nickname) - FROM COURSE -", str(inc_courses[asmt.course_key]), "- ON -", asmt.source, "- DUE AT -", asmt.due_text)
+            else:
+                print("ASSIGNMENT -", str(asmt), "- FROM COURSE -", str(inc_courses[asmt.course_key]), "- ON -", asmt.source, "- DUE AT -", asmt.due_text)
+
+
+# Included assignments as flat rows (in date order), for the json and csv output
+# name is the name on Canvas and nickname the user's nickname for it (None if it has none), so each column means one thing
+def assignment_rows():
+    return [{"date": date.isoformat(), "source": asmt.source, "id": asmt.id, "name": asmt.name, "nickname": assignment_nnames.get(asmt.key),
+             "course_id": asmt.course_id, "course": str(inc_courses[asmt.course_key]),
+             "due_at": asmt.due_at_date.astimezone().isoformat(), "html_url": asmt.html_url}
+            for date, bucket in inc_assignments for asmt in bucket]
+
+
+# Write included assignments to a file in the given format ("text" is print_assignments())
+def write_assignments(output_format, out):
+    if output_format == "json":
+        json.dump(assignment_rows(), out, indent=2)
+        out.write("\n")
+    elif output_format == "csv":
+        writer = csv.DictWriter(out, fieldnames=["date", "source", "id", "name", "nickname", "course_id", "course", "due_at", "html_url"])
+        writer.writeheader()
+        writer.writerows(assignment_rows())
+    else:
+        print_assignments()
+
+
+# Text an assignment is listed with (its nickname if it has one)
+def assignment_label(asmt):
+    return assignment_nnames.get(asmt.key, str(asmt))
+
+
+# Number of rows and text of one row of the date list, read straight from the date index
+def date_row_count():
+    return len(inc_assignments)
+
+
+def date_row_text(i):
+    return date_text(inc_assignments.date_at(i))
+
+
+# Number of rows and text of one row of the assignment list (the assignments of the selected date)
+def asmt_row_count():
+    return len(inc_assignments.bucket_at(date_ind)) if date_ind < len(inc_assignments) else 0
+
+
+def asmt_row_text(i):
+    return assignment_label(inc_assignments.bucket_at(date_ind)[i])
+
+
+# Redraw the date list and the assignment list for the selected date
+def render_date_list():
+    with Span("render_lists") as span:
+        listbox_dates.redraw()
+        render_asmt_list()
+        span.items = date_row_count() + asmt_row_count()
+
+
+# Redraw the assignment list for the selected date (or nothing if it's gone)
+def render_asmt_list():
+    listbox_assignments.redraw()
+
+
+# Put an assignment into the included view, shifting only the rows it adds
+def show_assignment(asmt):
+    global date_ind
+    global asmt_ind
+
+    position = inc_assignments.add(asmt)
+    if position is None:  # Already shown
+        return
+    date_index, row, new_date = position
+    if new_date:
+        # New date row; the selected date moves down if it's after it
+        if date_index <= date_ind < len(inc_assignments) - 1:
+            date_ind += 1
+        listbox_dates.inserted(date_index)
+    elif date_index == date_ind:
+        # Assignment lands in the date that is on display; the selected assignment moves down if it's after it
+        listbox_assignments.inserted(row)
+        if row <= asmt_ind:
+            asmt_ind += 1
+
+
+# Take an assignment out of the included view, shifting only the rows it leaves behind
+def hide_assignment(asmt):
+    global date_ind
+    global asmt_ind
+
+    position = inc_assignments.remove(asmt)
+    if position is None:  # Wasn't shown
+        return
+    date_index, row, date_gone = position
+    if date_gone:
+        # Date row is gone; the selected date moves up if it was after it
+        listbox_dates.deleted(date_index)
+        if date_index < date_ind:
+            date_ind -= 1
+        elif date_index == date_ind:
+            # The date on display is gone, so show the one that took its place (with no assignment selected)
+            listbox_assignments.reset()
+            asmt_ind = 0
+            if date_ind < len(inc_assignments):
+                listbox_dates.selection_set(date_ind)
+    elif date_index == date_ind:
+        # The selected assignment moves up if it was after it, or is unselected if it was the one removed
+        listbox_assignments.deleted(row)
+        if row < asmt_ind:
+            asmt_ind -= 1
+        elif row == asmt_ind:
+            asmt_ind = 0  # Nothing is selected now (handlers check the list's selection before using asmt_ind)
+
+
+# Move assignments between included and past due for the current cutoff, touching only the ones due between the old
+# cutoff and the new one (found by binary search in due_order), then redraw the lists once. No downloading.
+def apply_cutoff():
+    global pd_assignments
+    global date_ind
+    global asmt_ind
+
+    old = len(pd_assignments)
+    new = cutoff_index(assignment_lower_cutoff)
+    if new == old:  # No assignment is due between the cutoffs
+        return
+    print("Moving", abs(new - old), "assignments", "into view" if new < old else "out of view")
+
+    # Remember what's selected, to find it again after the move
+    selected = inc_assignments.date_at(date_ind) if date_ind < len(inc_assignments) else None
+    selected_size = len(inc_assignments.bucket_at(date_ind)) if selected is not None else 0
+
+    if new < old:
+        # Cutoff moved back: assignments due between the cutoffs come back (ignored ones stay hidden unless showing all)
+        showing_all = show_all.get()
+        for asmt in due_order[new:old]:
+            if asmt.key in ignored_assignments and not showing_all:
+                exc_assignments[asmt.key] = asmt
             else:
-                print("ASSIGNMENT -", str(asmt), "- FROM COURSE -", str(inc_courses[asmt.course_id]), "- DUE AT -", asmt.due_at_date.astimezone().strftime("%m/%d/%Y, %H:%M:%S"))
+                inc_assignments.add(asmt)
+    else:
+        # Cutoff moved forward: assignments due between the cutoffs are past due now
+        for asmt in due_order[old:new]:
+            exc_assignments.pop(asmt.key, None)
+            inc_assignments.remove(asmt)
+    pd_assignments = due_order[:new]
+
+    # Keep the selected date if it's still there, otherwise select the date that took its place
+    date_ind = bisect.bisect_left(inc_assignments.dates, selected) if selected is not None else 0
+    kept = date_ind < len(inc_assignments) and inc_assignments.date_at(date_ind) == selected
+    date_ind = min(date_ind, max(len(inc_assignments) - 1, 0))
+    if len(inc_assignments) == 0:
+        listbox_dates.reset()
+    else:
+        listbox_dates.selection_set(date_ind)
+    if kept and len(inc_assignments.bucket_at(date_ind)) == selected_size:
+        listbox_assignments.redraw()  # Same assignments on display
+    else:
+        asmt_ind = 0
+        listbox_assignments.reset()
 
 
-# Main execution
-# refresh_assignments(False)
-# refresh_data(True, True)
-# save_data()
-# print_assignments()
-print("<=== Finished processing! Time taken:", str(round((time.time() - start_time), 4)), "seconds ===>")
+# Redraw the row of one assignment if its date is on display (after a nickname change)
+def relabel_assignment(asmt):
+    if asmt not in inc_assignments or date_ind >= len(inc_assignments):
+        return
+    bucket = inc_assignments.bucket_at(date_ind)
+    if asmt in bucket:
+        listbox_assignments.changed(bucket.index(asmt))
 
 
 # Get a reliable reading of a listbox's cursor selection index
@@ -269,25 +1401,187 @@ def curselval(listbox):
 
 # START OF GUI CODE
 
+# -- Widgets --
+# A listbox that only ever holds the rows that fit on screen. Row text is asked for on demand from row_text(index), and
+# row_count() says how many rows there are, so a list of any length costs the same to show, scroll and select in.
+# Indexes given to and returned by it are always indexes into the whole list, not the visible window.
+class VirtualList:
+    def __init__(self, parent, row_count, row_text, on_select=None, height=10, width=20):
+        self.row_count = row_count
+        self.row_text = row_text
+        self.on_select = on_select
+        self.top = 0          # Index of the first visible row
+        self.visible = height  # Number of rows that fit on screen
+        self.selected = None  # Index of the selected row (None if nothing is selected)
+
+        # Inner listbox and its scrollbar, which scrolls the window over the whole list instead of the listbox itself
+        self.frame = ttk.Frame(parent)
+        self.listbox = Listbox(self.frame, height=height, width=width, exportselection=False)
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=VERTICAL, command=self.yview)
+        self.listbox.grid(column=0, row=0, sticky=(N, S, E, W))
+        self.scrollbar.grid(column=1, row=0, sticky=(N, S))
+        self.frame.columnconfigure(0, weight=1)
+        self.frame.rowconfigure(0, weight=1)
+        self.linespace = font.nametofont(self.listbox.cget('font')).metrics('linespace') + 1  # Height of one row in pixels
+
+        # Events
+        self.listbox.bind('<<ListboxSelect>>', self._clicked)
+        self.listbox.bind('<Configure>', self._resized)
+        self.listbox.bind('<MouseWheel>', lambda event: self.yview('scroll', -1 if event.delta > 0 else 1, 'units'))
+        self.listbox.bind('<Button-4>', lambda event: self.yview('scroll', -1, 'units'))  # Linux wheel up
+        self.listbox.bind('<Button-5>', lambda event: self.yview('scroll', 1, 'units'))   # Linux wheel down
+        self.listbox.bind('<Up>', lambda event: self._step(-1))
+        self.listbox.bind('<Down>', lambda event: self._step(1))
+        self.listbox.bind('<Prior>', lambda event: self._step(-self.visible))
+        self.listbox.bind('<Next>', lambda event: self._step(self.visible))
+
+    def grid(self, **options):
+        self.frame.grid(**options)
+
+    # Same as Listbox.curselection(), but with the index into the whole list
+    def curselection(self):
+        return () if self.selected is None else (self.selected,)
+
+    def selection_set(self, index):
+        self.selected = index
+        self.see(index)
+
+    # Forget the scroll position and selection, for when the whole list is swapped out
+    def reset(self):
+        self.top = 0
+        self.selected = None
+        self.redraw()
+
+    # Scroll just enough to make a row visible
+    def see(self, index):
+        if index < self.top:
+            self.top = index
+        elif index >= self.top + self.visible:
+            self.top = index - self.visible + 1
+        self.redraw()
+
+    # A row was added to or removed from the underlying list at index; keep the selection on the same item
+    def inserted(self, index):
+        if self.selected is not None and index <= self.selected:
+            self.selected += 1
+        self.redraw()
+
+    def deleted(self, index):
+        if self.selected is not None:
+            if index == self.selected:
+                self.selected = None
+            elif index < self.selected:
+                self.selected -= 1
+        self.redraw()
+
+    # The text of a row changed; only redraw if it's on screen
+    def changed(self, index):
+        if self.top <= index < self.top + self.visible:
+            self.redraw()
+
+    # Fill the inner listbox with the visible rows only
+    def redraw(self):
+        count = self.row_count()
+        self.top = max(0, min(self.top, count - self.visible))
+        if self.selected is not None and self.selected >= count:
+            self.selected = None
+        end = min(self.top + self.visible, count)
+
+        self.listbox.delete(0, END)
+        self.listbox.insert(END, *[self.row_text(i) for i in range(self.top, end)])
+        if self.selected is not None and self.top <= self.selected < end:
+            self.listbox.selection_set(self.selected - self.top)
+        if count == 0:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.top / count, end / count)
+
+    # Scrollbar command ('moveto', fraction) or ('scroll', amount, 'units'/'pages')
+    def yview(self, *args):
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * self.row_count())
+        elif args[0] == 'scroll':
+            self.top += int(args[1]) * (self.visible if args[2] == 'pages' else 1)
+        self.redraw()
+
+    def _clicked(self, event):
+        sel = self.listbox.curselection()
+        if len(sel) != 0:
+            self.selected = self.top + sel[0]
+            if self.on_select is not None:
+                self.on_select(event)
+
+    def _resized(self, event):
+        visible = max(1, event.height // self.linespace)
+        if visible != self.visible:
+            self.visible = visible
+            self.redraw()
+
+    def _step(self, amount):
+        count = self.row_count()
+        if count != 0:
+            start = self.top if self.selected is None else self.selected
+            self.selection_set(max(0, min(start + amount, count - 1)))
+            if self.on_select is not None:
+                self.on_select(None)
+        return "break"  # Stop the inner listbox from moving its own selection
+
+
 # -- Functions --
-# Add an assignment's id to the list of ignored assignments and refresh data without removing or loading ids
+# The assignment selected in the assignment list, or None if no row is selected (none was clicked yet, or the selected one
+# was just removed from the list)
+def selected_assignment():
+    if len(listbox_assignments.curselection()) == 0 or date_ind >= len(inc_assignments):
+        return None
+    return inc_assignments.bucket_at(date_ind)[asmt_ind]
+
+
+# Add an assignment's id to the ignored assignments and move just that assignment out of view (unless showing all)
 def ignore_assignment():
-    ignored_assignments.append(inc_assignments[date_ind][asmt_ind + 1].id)
-    refresh_data(False, False)
+    asmt = selected_assignment()
+    if asmt is None:
+        return
+    ignored_assignments.add(asmt.key)
+    pending_ignores[asmt.key] = True
+    if not show_all.get():
+        hide_assignment(asmt)
+        exc_assignments[asmt.key] = asmt
 
 
-# Rename an assignment by adding text from the input box to the nickname dictionary under the assignment's id
+# Rename an assignment by adding text from the input box to the nickname dictionary under the assignment's key
 def rename_assignment():
-    global assignment_nnames
-
-    assignment_nnames[inc_assignments[date_ind][asmt_ind + 1].id] = nickname
-    refresh_data(False, False)
+    asmt = selected_assignment()
+    if asmt is None:
+        return
+    assignment_nnames[asmt.key] = nickname.get()
+    pending_nnames[asmt.key] = assignment_nnames[asmt.key]
+    relabel_assignment(asmt)
 
 
-# Remove an assignment's nickname by removing the entry of the nickname dictionary under the assignment's id
+# Remove an assignment's nickname by removing the entry of the nickname dictionary under the assignment's key
 def remove_assignment_nickname():
-    assignment_nnames.pop(inc_assignments[date_ind][asmt_ind + 1].id)
-    refresh_data(False, False)
+    asmt = selected_assignment()
+    if asmt is None:
+        return
+    assignment_nnames.pop(asmt.key, None)
+    pending_nnames[asmt.key] = None
+    relabel_assignment(asmt)
+
+
+# Move ignored assignments in or out of view when 'Show all' is toggled
+def toggle_show_all():
+    if show_all.get():
+        # Bring every hidden assignment back
+        for asmt in exc_assignments.values():
+            show_assignment(asmt)
+        exc_assignments.clear()
+    else:
+        # Hide every ignored assignment that is on display
+        for key in ignored_assignments:
+            asmt = inc_assignments.by_key.get(key)
+            if asmt is not None:
+                hide_assignment(asmt)
+                exc_assignments[key] = asmt
 
 
 # Update gui settings when the user switches cutoff config mode, then update
@@ -305,10 +1599,23 @@ def update_config_mode():
     # Update function will automatically trigger as part of the trace set earlier.
 
 
-# Attempt to process the cutoff config input into the global assignment cutoff value. Do nothing if input is invalid.
+# Apply the cutoff input once it stops changing for CUTOFF_DELAY (called on every keystroke)
 def try_cutoff_update(var, index, mode):  # no params are used but python complains if they aren't there
+    global cutoff_after
+
+    if cutoff_after is not None:  # Still typing, start waiting over
+        tk_root.after_cancel(cutoff_after)
+    cutoff_after = tk_root.after(CUTOFF_DELAY, update_cutoff)
+
+
+# Attempt to process the cutoff config input into the global assignment cutoff value and apply it to the lists.
+# Do nothing if input is invalid.
+def update_cutoff():
     # Declare globals
     global assignment_lower_cutoff
+    global cutoff_after
+
+    cutoff_after = None
 
     # Check mode
     if auto_date.get() == 0:
@@ -327,18 +1634,18 @@ def try_cutoff_update(var, index, mode):  # no params are used but python compla
             pass
 # my hope is that this code is so horrendous that the python developers have no choice but to rework the datetime system
     print("New cutoff date:", assignment_lower_cutoff)
+    apply_cutoff()
 
 
 # Open the link of the selected assignment in the user's default browser
 def open_selected_link():
-    link = inc_assignments[date_ind][1:][asmt_ind].html_url
-    wb.open_new_tab(link)
+    asmt = selected_assignment()
+    if asmt is not None:
+        wb.open_new_tab(asmt.html_url)
 
 
 # Update selection indexes for changing date and set values of assignment display to the assignments of selected date
 def update_asmt_list(pointless_tkinter_provided_argument_that_will_not_be_used):
-    global listbox_assignments
-    global list_assignments
     global date_ind
     global asmt_ind
 
@@ -348,12 +1655,8 @@ def update_asmt_list(pointless_tkinter_provided_argument_that_will_not_be_used):
         date_ind = d
         asmt_ind = 0
 
-        # Apply new entries to assignment listbox
-        listbox_assignments.delete(0, len(list_assignments.get())-1)  # Remove old entries
-        entries = inc_assignments[date_ind][1:]                       # Get list of assignments
-        list_assignments = StringVar(value=entries)                   # Update list of assignments
-        for i, entry in enumerate(entries):                           # Reinsert new assignments into listbox
-            listbox_assignments.insert(i, entry)
+        # Show the new date's assignments from the top
+        listbox_assignments.reset()
 
 
 # Update selection index for selecting assignment
@@ -366,94 +1669,277 @@ def update_asmt_sel_ind(pointless_tkinter_provided_argument_that_will_not_be_use
         asmt_ind = d
 
 
+# Start a background refresh, or join the one already in flight if there is one
+def start_background_refresh():
+    global refresh_thread
+    global refresh_polling
+
+    if refresh_polling:
+        # Repeated click: the refresh in flight (or its result, if the worker is done but wasn't polled yet) will update the
+        # window when it's handled. Starting another one here would start a second poll loop next to the first.
+        print("Refresh already in progress")
+        return
+
+    refresh_cancel.clear()
+    refresh_thread = threading.Thread(target=refresh_worker, name="canvis-refresh", daemon=True)
+    refresh_thread.start()
+    refresh_status.set("Downloading...")
+    refresh_progress.configure(value=0)
+    cancel_button.state(['!disabled'])
+    refresh_polling = True
+    tk_root.after(100, poll_refresh_queue)  # Start checking for results
+
+
+# Ask the background refresh in flight to stop
+def cancel_refresh():
+    if refresh_thread is not None and refresh_thread.is_alive():
+        refresh_cancel.set()
+        refresh_status.set("Cancelling...")
+
+
+# Handle every message the background refresh has sent since the last poll, then poll again unless it's finished
+def poll_refresh_queue():
+    global refresh_polling
+
+    finished = False
+    try:
+        while True:
+            try:
+                message = refresh_queue.get_nowait()
+            except queue.Empty:  # Nothing left to handle
+                break
+
+            if message[0] == "progress":
+                # Update the progress indicator
+                done, total = message[1], message[2]
+                refresh_progress.configure(maximum=max(total, 1), value=done)
+                refresh_status.set("Downloading... (" + str(done) + "/" + str(total) + ")")
+            elif message[0] == "done":
+                # Apply the new data in one go (None means the refresh was cancelled)
+                finished = True
+                if message[1] is None:
+                    refresh_status.set("Download cancelled")
+                else:
+                    try:
+                        apply_download(message[1])
+                        refresh_status.set("Up to date")
+                    except Exception as err:  # Applying failed (the data file being locked, say), report it like a failed download
+                        print("Failed to apply downloaded data:", err)
+                        refresh_status.set("Download failed")
+            else:
+                # The download failed
+                finished = True
+                print("Failed to download data:", message[1])
+                refresh_status.set("Download failed")
+    finally:  # Whatever happened above, a finished refresh lets later clicks start another, and an unfinished one is polled again
+        if finished:
+            refresh_polling = False
+            cancel_button.state(['disabled'])
+        else:
+            tk_root.after(100, poll_refresh_queue)
+
+
+# Reload assignments from the cache and refresh filters, without going online
+def offline_refresh():
+    apply_download(load_cache(), False)
+
+
 # -- Variables --
 date_ind = 0
 asmt_ind = 0
+cutoff_after = None  # Pending tk_root.after() call of update_cutoff() (None if there isn't one)
+
 
 # -- Set up window --
-# Create window
-tk_root.title("canvis")
-
-# Create window frame
-mainframe = ttk.Frame(tk_root, padding="4 6 12 12")
-
-# Place it inside the main window
-mainframe.grid(column=0, row=0, sticky=(N, W, E, S))
-
-# Set root to automatically expand frame
-tk_root.columnconfigure(0, weight=1)
-tk_root.rowconfigure(0, weight=1)
-
-# -- Set up widgets --
-# ROW 1: Auto-date setting, date config label, date config, & 'Show all' checkbox
-date_labels = ("Cutoff before date:", "Cutoff due days ago:")
-dconf_label = StringVar(value=date_labels[1])
-asmt_lower_cutoff_input = StringVar(value='2')
-
-# Date config label
-ttk.Label(mainframe, textvariable=dconf_label).grid(column=1, row=1, sticky=E)
-
-# Date config
-asmt_lower_cutoff_input.trace_add('write', try_cutoff_update)  # Call update when input changes
-l_cutoff_entry = ttk.Entry(mainframe, width=9, textvariable=asmt_lower_cutoff_input)
-l_cutoff_entry.grid(column=2, row=1, sticky=W)
-
-# Auto-date setting
-auto_date = IntVar(value=1)
-auto_date_button = ttk.Checkbutton(mainframe, width=14, variable=auto_date, text="Auto-date", command=update_config_mode)
-auto_date_button.grid(column=3, row=1)
-
-# 'Show all' checkbox
-show_all = BooleanVar()
-showall_entry = ttk.Checkbutton(mainframe, width=14, variable=show_all, text="Show all")
-showall_entry.grid(column=4, row=1, sticky=(E, W))
-
-# ROW 2: Listbox labels, open link, & ignore button
-# Listbox labels
-ttk.Label(mainframe, text="Dates of assignments").grid(column=1, row=2, sticky=S)
-ttk.Label(mainframe, text="Assignments of date").grid(column=2, row=2, sticky=S)
-
-# Open link button
-ttk.Button(mainframe, text="Open link", command=open_selected_link).grid(column=3, row=2, sticky=(E, W))
-
-# Ignore button
-ttk.Button(mainframe, text="Ignore", command=ignore_assignment).grid(column=4, row=2, sticky=(E, W))
-
-# ROW 3: Set & remove nickname buttons
-ttk.Button(mainframe, text="Set nickname", command=rename_assignment).grid(column=3, row=3, sticky=(E, W))
-ttk.Button(mainframe, text="Remove nickname", command=remove_assignment_nickname).grid(column=4, row=3, sticky=(E, W))
-
-# ROW 4: 'Nickname' entry box
-nickname = StringVar()
-nickname_entry = ttk.Entry(mainframe, width=14, textvariable=nickname)
-nickname_entry.grid(column=3, columnspan=2, row=4, sticky=(W, E))
-
-# ROW 5: Save button
-ttk.Button(mainframe, text="Save changes", command=save_data).grid(column=4, row=5, sticky=(E, W))
-
-# ROW 6: Download/filter data buttons
-ttk.Button(mainframe, text="Redownload data", command=refresh_assignments).grid(column=4, row=6, sticky=(E, W))
-ttk.Button(mainframe, text="Offline refresh", command=refresh_data).grid(column=3, row=6, sticky=(E, W))
-
-# LISTBOXES
-# Date listbox
-list_dates = StringVar(value=[date[0].strftime('%m/%d/%y') for date in inc_assignments])
-listbox_dates = Listbox(mainframe, listvariable=list_dates, height=10)
-listbox_dates.grid(column=1, row=3, rowspan=4, sticky=(N, S, E, W))
-listbox_dates.bind('<<ListboxSelect>>', update_asmt_list)
-
-# Assignment listbox
-list_assignments = StringVar(value=[])
-listbox_assignments = Listbox(mainframe, listvariable=list_assignments, height=10)
-listbox_assignments.grid(column=2, row=3, rowspan=4, sticky=(N, S, E, W))
-listbox_assignments.bind('<<ListboxSelect>>', update_asmt_sel_ind)
-
-# -- Finish up --
-# Add padding to all children of the main frame
-for child in mainframe.winfo_children():
-    child.grid_configure(padx=5, pady=5)
-
-# Finally, start the main loop
-tk_root.mainloop()
+# Import tkinter and build the window with all its widgets (widgets that other functions use are kept as globals)
+def build_gui():
+    global tk_root, ttk, font
+    global dconf_label, date_labels, asmt_lower_cutoff_input, auto_date, show_all, nickname
+    global refresh_status, refresh_progress, cancel_button, listbox_dates, listbox_assignments
+
+    import tkinter
+    from tkinter import ttk       # modern tkinter widgets
+    from tkinter import font      # to measure listbox rows
+    # Same as "from tkinter import *", but only once the gui is wanted (names already taken are kept)
+    globals().update({name: getattr(tkinter, name) for name in tkinter.__all__ if name not in globals()})
+
+    tk_root = Tk()  # Create tkinter root
+    # Create window
+    tk_root.title("canvis")
+
+    # Create window frame
+    mainframe = ttk.Frame(tk_root, padding="4 6 12 12")
+
+    # Place it inside the main window
+    mainframe.grid(column=0, row=0, sticky=(N, W, E, S))
+
+    # Set root to automatically expand frame
+    tk_root.columnconfigure(0, weight=1)
+    tk_root.rowconfigure(0, weight=1)
+
+    # -- Set up widgets --
+    # ROW 1: Auto-date setting, date config label, date config, & 'Show all' checkbox
+    date_labels = ("Cutoff before date:", "Cutoff due days ago:")
+    dconf_label = StringVar(value=date_labels[1])
+    asmt_lower_cutoff_input = StringVar(value='2')
+
+    # Date config label
+    ttk.Label(mainframe, textvariable=dconf_label).grid(column=1, row=1, sticky=E)
+
+    # Date config
+    asmt_lower_cutoff_input.trace_add('write', try_cutoff_update)  # Call update when input changes
+    l_cutoff_entry = ttk.Entry(mainframe, width=9, textvariable=asmt_lower_cutoff_input)
+    l_cutoff_entry.grid(column=2, row=1, sticky=W)
+
+    # Auto-date setting
+    auto_date = IntVar(value=1)
+    auto_date_button = ttk.Checkbutton(mainframe, width=14, variable=auto_date, text="Auto-date", command=update_config_mode)
+    auto_date_button.grid(column=3, row=1)
+
+    # 'Show all' checkbox
+    show_all = BooleanVar()
+    showall_entry = ttk.Checkbutton(mainframe, width=14, variable=show_all, text="Show all", command=toggle_show_all)
+    showall_entry.grid(column=4, row=1, sticky=(E, W))
+
+    # ROW 2: Listbox labels, open link, & ignore button
+    # Listbox labels
+    ttk.Label(mainframe, text="Dates of assignments").grid(column=1, row=2, sticky=S)
+    ttk.Label(mainframe, text="Assignments of date").grid(column=2, row=2, sticky=S)
+
+    # Open link button
+    ttk.Button(mainframe, text="Open link", command=open_selected_link).grid(column=3, row=2, sticky=(E, W))
+
+    # Ignore button
+    ttk.Button(mainframe, text="Ignore", command=ignore_assignment).grid(column=4, row=2, sticky=(E, W))
+
+    # ROW 3: Set & remove nickname buttons
+    ttk.Button(mainframe, text="Set nickname", command=rename_assignment).grid(column=3, row=3, sticky=(E, W))
+    ttk.Button(mainframe, text="Remove nickname", command=remove_assignment_nickname).grid(column=4, row=3, sticky=(E, W))
+
+    # ROW 4: 'Nickname' entry box
+    nickname = StringVar()
+    nickname_entry = ttk.Entry(mainframe, width=14, textvariable=nickname)
+    nickname_entry.grid(column=3, columnspan=2, row=4, sticky=(W, E))
+
+    # ROW 5: Save button
+    ttk.Button(mainframe, text="Save changes", command=save_data).grid(column=4, row=5, sticky=(E, W))
+
+    # ROW 6: Download/filter data buttons
+    ttk.Button(mainframe, text="Redownload data", command=start_background_refresh).grid(column=4, row=6, sticky=(E, W))
+    ttk.Button(mainframe, text="Offline refresh", command=offline_refresh).grid(column=3, row=6, sticky=(E, W))
+
+    # ROW 7: Download status, progress & cancel button
+    refresh_status = StringVar(value="")
+    ttk.Label(mainframe, textvariable=refresh_status).grid(column=1, columnspan=2, row=7, sticky=W)
+    refresh_progress = ttk.Progressbar(mainframe, orient=HORIZONTAL, mode='determinate')
+    refresh_progress.grid(column=3, row=7, sticky=(E, W))
+    cancel_button = ttk.Button(mainframe, text="Cancel", command=cancel_refresh)
+    cancel_button.grid(column=4, row=7, sticky=(E, W))
+    cancel_button.state(['disabled'])
+
+    # LISTBOXES
+    # Date listbox
+    listbox_dates = VirtualList(mainframe, date_row_count, date_row_text, on_select=update_asmt_list, height=10, width=12)
+    listbox_dates.grid(column=1, row=3, rowspan=4, sticky=(N, S, E, W))
+
+    # Assignment listbox
+    listbox_assignments = VirtualList(mainframe, asmt_row_count, asmt_row_text, on_select=update_asmt_sel_ind, height=10, width=40)
+    listbox_assignments.grid(column=2, row=3, rowspan=4, sticky=(N, S, E, W))
+
+    # -- Finish up --
+    # Add padding to all children of the main frame
+    for child in mainframe.winfo_children():
+        child.grid_configure(padx=5, pady=5)
+
 
 # END OF GUI CODE
+
+
+# -- Main --
+def main(argv=None):
+    global BASEURL
+    global fetch_strategy
+    global profiling
+    global profile_trace_file
+    global profile_cprofile_file
+
+    parser = argparse.ArgumentParser(description="Simplified Canvas assignment planner. Opens the gui unless --headless is given.")
+    parser.add_argument("--headless", action="store_true", help="don't open the gui, write included assignments to stdout instead")
+    parser.add_argument("--format", choices=("text", "json", "csv"), default="text", help="headless output format (default: text)")
+    parser.add_argument("--cached", action="store_true", help="headless: use cached data only, without signing in or downloading")
+    parser.add_argument("--days", type=int, help="headless: include assignments due up to this many days ago")
+    parser.add_argument("--fetch", choices=("course", "calendar"), help="download assignments one course at a time, or in bulk through the calendar")
+    parser.add_argument("--base-url", metavar="URL", help="Canvas instance of the default account (default: CANVAS_BASE_URL, or " + BASEURL + "), not used with CANVIS_ACCOUNTS")
+    parser.add_argument("--profile", action="store_true", help="time signin, downloads, filtering, sorting, redraws and saves, and print a summary at exit")
+    parser.add_argument("--trace", metavar="FILE", help="profile, and write every timed span to FILE as a JSON trace (chrome://tracing, ui.perfetto.dev)")
+    parser.add_argument("--cprofile", metavar="FILE", help="dump cProfile stats of the whole run to FILE (read with python -m pstats FILE)")
+    args = parser.parse_args(argv)
+
+    if args.base_url is not None:
+        BASEURL = args.base_url
+    if args.fetch is not None:
+        fetch_strategy = args.fetch
+    if args.trace is not None:
+        profile_trace_file = args.trace
+    if args.cprofile is not None:
+        profile_cprofile_file = args.cprofile
+    profiling = profiling or args.profile or profile_trace_file is not None
+
+    # cProfile only sees the thread it's started on before Python 3.12 (download threads are still timed by the spans)
+    profiler = cProfile.Profile() if profile_cprofile_file is not None else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        if args.headless:
+            run_headless(args)
+        else:
+            run_gui()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_cprofile_file)
+            print("Wrote cProfile stats to", profile_cprofile_file, file=sys.stderr)
+        with redirect_stdout(sys.stderr):  # Keeps headless output clean
+            finish_profile()
+
+
+# Download (or load) data, filter and sort it, then write it out, all without tkinter
+def run_headless(args):
+    global assignment_lower_cutoff
+
+    if args.days is not None:
+        assignment_lower_cutoff = (dt.datetime.now() - dt.timedelta(days=args.days)).replace(tzinfo=local_tz)
+
+    # Progress messages go to stderr so stdout only has the output
+    with redirect_stdout(sys.stderr):
+        print("<=== Starting ===>")
+        start_time = time.time()  # Record start time
+        if args.cached:
+            apply_download(load_cache(), False)
+        else:
+            apply_download(download_assignments())
+        print("<=== Finished processing! Time taken:", str(round((time.time() - start_time), 4)), "seconds ===>")
+    write_assignments(args.format, sys.stdout)
+
+
+def run_gui():
+    print("<=== Starting ===>")
+    start_time = time.time()  # Record start time
+    build_gui()
+
+    # Fill the window with the last downloaded data right away
+    apply_download(load_cache(), False)
+    tk_root.update_idletasks()  # Draw the window now instead of when the main loop starts
+    print("<=== First window after", str(round(time.perf_counter() - startup_clock, 4)), "seconds (" +
+          str(round((time.time() - start_time), 4)), "after the gui started) ===>")
+
+    # Sign in (and load canvasapi) while the user looks at cached data
+    if any(account.token for account in canvas_accounts()):
+        threading.Thread(target=background_sign_in, name="canvis-signin", daemon=True).start()
+
+    # Finally, start the main loop
+    tk_root.mainloop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Tests for canvis (main.py). Downloads go to a fake_canvas.FakeCanvas on localhost, so no Canvas token or network
+connection is needed, and canvis's data and cache files are kept in a temporary directory. Run with 'python -m pytest'.
+"""
+
+# Imports
+import os                     # to clear the cache
+import time                   # to time refreshes
+import warnings               # to quiet canvasapi about the fake server being plain http
+import pytest
+import main                   # the program being tested
+from fake_canvas import FakeCanvas
+
+LATENCY = 0.05  # Seconds each fake request waits, so concurrency shows up over the overhead of running locally
+
+
+# Run every test in its own directory with fresh accounts, so data and cache files don't leak between tests
+@pytest.fixture(autouse=True)
+def canvis_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, "accounts", None)
+    monkeypatch.setattr(main, "fetch_strategy", "course")
+    monkeypatch.setattr(main, "ignored_assignments", set())
+    monkeypatch.setattr(main, "assignment_nnames", {})
+    monkeypatch.setattr(main, "pending_ignores", {})
+    monkeypatch.setattr(main, "pending_nnames", {})
+    warnings.filterwarnings("ignore", message="Canvas may respond unexpectedly")
+    return tmp_path
+
+
+# A fake Canvas with latency, stopped when the test is done
+@pytest.fixture
+def fake_canvas():
+    canvas = FakeCanvas(courses=12, assignments=20, latency=LATENCY)
+    canvas.start()
+    yield canvas
+    canvas.stop()
+
+
+# Point canvis at a fake Canvas with a fresh account (signed out, nothing cached)
+def use_fake(canvas):
+    main.accounts = [main.Account("test", canvas.url, "token")]
+
+
+# Refresh against a fake Canvas from an empty cache with some number of workers, returning the seconds it took and the
+# keys of the included assignments
+def timed_refresh(canvas, monkeypatch, workers):
+    monkeypatch.setattr(main, "download_workers", workers)
+    use_fake(canvas)
+    main.sign_in()  # Signing in isn't what's being compared
+    start = time.perf_counter()
+    main.refresh_assignments()
+    taken = time.perf_counter() - start
+    os.remove(main.CACHE_FILE)  # The next refresh starts from an empty cache too
+    return taken, [asmt.key for asmt in main.inc_assignments.assignments()]
+
+
+# Downloading course assignments at the same time is much faster than one after another, and gets the same result
+def test_concurrent_refresh_is_faster(fake_canvas, monkeypatch):
+    serial, serial_keys = timed_refresh(fake_canvas, monkeypatch, 1)
+    concurrent, concurrent_keys = timed_refresh(fake_canvas, monkeypatch, 8)
+
+    assert len(serial_keys) > 0
+    assert concurrent_keys == serial_keys
+    assert concurrent * 2 < serial, "concurrent refresh took {:.3f}s, serial {:.3f}s".format(concurrent, serial)
+
+
+# Refresh against a fake Canvas with the assignment cutoff some days from now, returning the keys of the included assignments
+def refresh_with_cutoff(canvas, monkeypatch, days):
+    monkeypatch.setattr(main, "assignment_lower_cutoff", main.dt.datetime.now(main.dt.timezone.utc) + main.dt.timedelta(days=days))
+    use_fake(canvas)
+    main.refresh_assignments()
+    return sorted(asmt.key for asmt in main.inc_assignments.assignments())
+
+
+# A sync that only asked Canvas for part of an ended course's assignments doesn't count as a full one: once the cutoff
+# moves back, the course is asked again instead of being served short from the cache
+# (course: bucket=future leaves out everything due before now, calendar: only due dates from the cutoff on are asked for)
+@pytest.mark.parametrize("first_strategy, first_cutoff, strategy", [("course", 1, "course"), ("calendar", -5, "course"),
+                                                                    ("calendar", -5, "calendar")])
+def test_partial_sync_isnt_settled(monkeypatch, first_strategy, first_cutoff, strategy):
+    canvas = FakeCanvas(courses=12, assignments=30)
+    canvas.start()
+    try:
+        monkeypatch.setattr(main, "fetch_strategy", first_strategy)
+        refresh_with_cutoff(canvas, monkeypatch, first_cutoff)
+        monkeypatch.setattr(main, "fetch_strategy", strategy)
+        after_partial = refresh_with_cutoff(canvas, monkeypatch, -60)
+        os.remove(main.CACHE_FILE)
+        assert after_partial == refresh_with_cutoff(canvas, monkeypatch, -60)
+    finally:
+        canvas.stop()
+
+
+# Json and csv rows carry the name from Canvas and the nickname in separate fields (None without a nickname)
+def test_rows_keep_name_and_nickname_apart(monkeypatch):
+    due = main.dt.datetime(2026, 3, 2, 12, tzinfo=main.dt.timezone.utc)
+    course = main.CourseRecord("canvas.example", 1, "Physics", "PHY", due)
+    asmts = [main.AssignmentRecord("canvas.example", i, 1, "Problem set " + str(i), due, "https://canvas.example/" + str(i)) for i in (1, 2)]
+    monkeypatch.setattr(main, "inc_courses", {course.key: course})
+    monkeypatch.setattr(main, "inc_assignments", main.sort_into_dates(asmts))
+    monkeypatch.setattr(main, "assignment_nnames", {("canvas.example", 2): "Kinematics"})
+
+    rows = {row["id"]: row for row in main.assignment_rows()}
+    assert (rows[1]["name"], rows[1]["nickname"]) == ("Problem set 1", None)
+    assert (rows[2]["name"], rows[2]["nickname"]) == ("Problem set 2", "Kinematics")
+
+
+# Ignores and nicknames that aren't saved yet survive a refresh rereading the data file, and are still saved afterwards
+def test_refresh_keeps_unsaved_changes():
+    main.pending_ignores.update({("canvas.example", 1): True})
+    main.pending_nnames.update({("canvas.example", 2): "Kinematics"})
+    main.save_data()
+    main.ignored_assignments.discard(("canvas.example", 1))  # Un-ignore and rename again, like from the gui during a download
+    main.pending_ignores[("canvas.example", 1)] = False
+    main.ignored_assignments.add(("canvas.example", 3))
+    main.pending_ignores[("canvas.example", 3)] = True
+    main.assignment_nnames[("canvas.example", 2)] = "Projectiles"
+    main.pending_nnames[("canvas.example", 2)] = "Projectiles"
+
+    main.refresh_data(False, True)
+    assert main.ignored_assignments == {("canvas.example", 3)}
+    assert main.assignment_nnames == {("canvas.example", 2): "Projectiles"}
+
+    main.save_data()
+    assert main.read_data() == ({("canvas.example", 3)}, {("canvas.example", 2): "Projectiles"})
+
+
+# With CANVIS_ACCOUNTS set but no account fully set up, downloads fail with an error saying what to set
+def test_no_usable_account(monkeypatch):
+    monkeypatch.setenv("CANVIS_ACCOUNTS", "foo")
+    with pytest.raises(ValueError, match="CANVIS_ACCOUNT_<NAME>_URL"):
+        main.download_assignments()
+    with pytest.raises(ValueError, match="CANVIS_ACCOUNT_<NAME>_URL"):
+        main.sign_in()
+
+
+# A legacy canvis.dat (ignored ids on line 0, nicknames on line 1) is moved into canvis.db under the default account's
+# instance, and kept as canvis.dat.migrated so it isn't migrated twice
+def test_legacy_data_is_migrated(canvis_dir):
+    (canvis_dir / main.LEGACY_DATA_FILE).write_text("[1, 2]\n{3: 'Kinematics'}\n")
+    source = main.instance_of(main.BASEURL)
+
+    assert main.read_data() == ({(source, 1), (source, 2)}, {(source, 3): "Kinematics"})
+    assert not (canvis_dir / main.LEGACY_DATA_FILE).exists()
+    assert (canvis_dir / (main.LEGACY_DATA_FILE + ".migrated")).exists()
+    assert main.read_data() == ({(source, 1), (source, 2)}, {(source, 3): "Kinematics"})  # Opening again changes nothing
+
+
+# A line of canvis.dat that doesn't parse (or holds the wrong type) falls back to empty, without losing the other line
+@pytest.mark.parametrize("ignored_line", ["[1, 2", "{1: 2}", "not a literal"])
+def test_malformed_legacy_line_falls_back_to_empty(canvis_dir, ignored_line):
+    (canvis_dir / main.LEGACY_DATA_FILE).write_text(ignored_line + "\n{3: 'Kinematics'}\n")
+    source = main.instance_of(main.BASEURL)
+
+    assert main.read_data() == (set(), {(source, 3): "Kinematics"})
+
+
+# Saving writes pending additions and removals of ignores and nicknames, which read_data() then reads back
+def test_save_writes_pending_changes():
+    main.pending_ignores.update({("canvas.example", 1): True, ("canvas.example", 2): True})
+    main.pending_nnames.update({("canvas.example", 3): "Kinematics", ("canvas.example", 4): "Projectiles"})
+    main.save_data()
+    assert (main.pending_ignores, main.pending_nnames) == ({}, {})
+
+    main.pending_ignores.update({("canvas.example", 1): False, ("other.example", 1): True})
+    main.pending_nnames.update({("canvas.example", 3): None, ("canvas.example", 4): "Vectors"})
+    main.save_data()
+    assert main.read_data() == ({("canvas.example", 2), ("other.example", 1)}, {("canvas.example", 4): "Vectors"})